@@ -0,0 +1,292 @@
+"""
+This module stores the job listings in compressed pack files instead of one .html file each.
+
+Each day gets its own append only pack file, every listing is compressed on its own with
+zlib so it can be read back without touching the others. The listings share most of their
+HTML, so they are compressed with a preset dictionary made from the first saved listing.
+An SQLite index maps the listing path (the same one written to the log) to its pack,
+offset and length.
+
+The existing state folders can be moved into the archive with:
+
+python3 archive.py
+"""
+
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+ARCHIVE_FOLDER = "./archive/"
+INDEX_FILE = ARCHIVE_FOLDER + "index.db"
+DICTIONARY_FILE = ARCHIVE_FOLDER + "dictionary.html"
+ROOT_FOLDER = "./states/"
+
+# zlib only uses the last 32 KB of the preset dictionary.
+DICTIONARY_SIZE = 32768
+
+# The connection is opened once per process, the scraper threads share it. Every use of
+# the connection (and the lazy loading of it and the dictionary) happens under the lock,
+# it's reentrant since save_listing already holds it when it gets the connection.
+connection = None
+connection_pid = None
+dictionary = None
+lock = threading.RLock()
+
+
+def get_connection():
+    """Opens the archive index and creates its table if it doesn't exist.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection to the index, shared by all the threads of this process. It
+        must only be used while holding the lock.
+
+    """
+
+    global connection, connection_pid
+
+    with lock:
+
+        # Connections can't be shared with forked processes.
+        if connection is None or connection_pid != os.getpid():
+
+            os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+
+            connection = sqlite3.connect(INDEX_FILE, check_same_thread=False)
+            connection_pid = os.getpid()
+
+            connection.execute("""CREATE TABLE IF NOT EXISTS listings (
+                path TEXT PRIMARY KEY, state TEXT NOT NULL, listing_id TEXT NOT NULL,
+                pack TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, saved REAL NOT NULL)""")
+
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS listings_state ON listings (state)")
+
+        return connection
+
+
+def get_dictionary(html_bytes=b""):
+    """Loads the preset dictionary, the first time a listing is saved it becomes the dictionary.
+
+    Parameters
+    ----------
+    html_bytes : bytes
+        The listing being saved, used to create the dictionary if it doesn't exist.
+        Readers don't specify it.
+
+    Returns
+    -------
+    bytes
+        The preset dictionary.
+
+    """
+
+    global dictionary
+
+    with lock:
+
+        if dictionary is None:
+
+            if not os.path.exists(DICTIONARY_FILE) and html_bytes:
+                os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+
+                with open(DICTIONARY_FILE, "wb") as temp_file:
+                    temp_file.write(html_bytes[-DICTIONARY_SIZE:])
+
+            try:
+                with open(DICTIONARY_FILE, "rb") as temp_file:
+                    dictionary = temp_file.read()
+            except FileNotFoundError:
+                raise FileNotFoundError(
+                    "The archive dictionary is missing: " + DICTIONARY_FILE)
+
+        return dictionary
+
+
+def split_path(file_name):
+    """Gets the state and listing id from a listing path like ./states/9/12345.html."""
+
+    state, listing_name = file_name.replace("\\", "/").split("/")[-2:]
+
+    return state, listing_name.split(".")[0]
+
+
+def save_listing(file_name, html_text, saved=None):
+    """Appends a listing to the pack of the day and adds it to the index.
+
+    Parameters
+    ----------
+    file_name : str
+        The listing path, the same one written to the log.
+
+    html_text : str
+        The HTML of the listing.
+
+    saved : float
+        The POSIX timestamp of when the listing was saved, defaults to now.
+
+    """
+
+    if saved is None:
+        saved = datetime.now().timestamp()
+
+    html_bytes = html_text.encode("utf-8")
+    state, listing_id = split_path(file_name)
+    pack = "{:%Y-%m-%d}.pack".format(datetime.fromtimestamp(saved))
+
+    with lock:
+
+        compressor = zlib.compressobj(9, zdict=get_dictionary(html_bytes))
+        data = compressor.compress(html_bytes) + compressor.flush()
+
+        # The data is on disk before the index points to it.
+        with open(ARCHIVE_FOLDER + pack, "ab") as temp_file:
+            offset = temp_file.tell()
+            temp_file.write(data)
+
+        connection = get_connection()
+
+        connection.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (file_name, state, listing_id, pack, offset, len(data), saved))
+        connection.commit()
+
+
+def get_entry(file_name):
+    """Gets the index entry (pack, offset, length, saved) of a listing, or None."""
+
+    # Without an archive nothing is archived, the index isn't created just to check it.
+    if not os.path.exists(INDEX_FILE):
+        return None
+
+    with lock:
+        return get_connection().execute(
+            "SELECT pack, offset, length, saved FROM listings WHERE path = ?", (file_name,)).fetchone()
+
+
+def read_listing(file_name):
+    """Reads a listing, from its .html file if it still exists or from the archive.
+
+    Parameters
+    ----------
+    file_name : str
+        The listing path, the same one written to the log.
+
+    Returns
+    -------
+    str
+        The HTML of the listing.
+
+    """
+
+    if os.path.exists(file_name):
+        with open(file_name, "r", encoding="utf-8") as temp_file:
+            return temp_file.read()
+
+    entry = get_entry(file_name)
+
+    if entry is None:
+        raise FileNotFoundError(file_name)
+
+    pack, offset, length, saved = entry
+
+    with open(ARCHIVE_FOLDER + pack, "rb") as temp_file:
+        temp_file.seek(offset)
+        data = temp_file.read(length)
+
+    decompressor = zlib.decompressobj(zdict=get_dictionary())
+
+    return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+def get_mtime(file_name):
+    """Gets the modification time of a listing file, or when it was archived.
+
+    Parameters
+    ----------
+    file_name : str
+        The listing path, the same one written to the log.
+
+    Returns
+    -------
+    float
+        The POSIX timestamp.
+
+    """
+
+    try:
+        return os.stat(file_name).st_mtime
+    except OSError:
+        pass
+
+    entry = get_entry(file_name)
+
+    if entry is None:
+        raise FileNotFoundError(file_name)
+
+    return entry[3]
+
+
+def load_listing_ids(state):
+    """Gets the ids of the archived listings of a state.
+
+    Parameters
+    ----------
+    state : str
+        The state number (1 - 32).
+
+    Returns
+    -------
+    set
+        The listings ids.
+
+    """
+
+    if not os.path.exists(INDEX_FILE):
+        return set()
+
+    with lock:
+        return {row[0] for row in get_connection().execute(
+            "SELECT listing_id FROM listings WHERE state = ?", (state,))}
+
+
+def migrate(root_folder=ROOT_FOLDER):
+    """Moves the .html files of all state folders into the archive.
+
+    The files keep their path and modification time in the index, so the log
+    and the listings store remain valid.
+
+    Parameters
+    ----------
+    root_folder : str
+        The folder that contains the state folders.
+
+    """
+
+    for state in sorted(os.listdir(root_folder)):
+
+        state_folder = root_folder + state + "/"
+        migrated = 0
+
+        for file_name in sorted(os.listdir(state_folder)):
+
+            if not file_name.endswith(".html"):
+                continue
+
+            file_path = state_folder + file_name
+
+            with open(file_path, "r", encoding="utf-8") as temp_file:
+                save_listing(file_path, temp_file.read(),
+                             os.stat(file_path).st_mtime)
+
+            os.remove(file_path)
+            migrated += 1
+
+        print("Migrated state {}: {} listings".format(state, migrated))
+
+
+if __name__ == "__main__":
+
+    migrate()
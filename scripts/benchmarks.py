@@ -0,0 +1,599 @@
+"""
+This script contains several benchmarks used to measure the performance of the other scripts.
+Each benchmark prints its timings, they can be run all at once or by name:
+
+python3 benchmarks.py
+python3 benchmarks.py seen_ids
+"""
+
+import concurrent.futures
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import lxml.html
+import numpy as np
+import pandas as pd
+
+import comments_bot
+import extractor
+import listings_store
+import post_bot
+import scraper
+import snapshot
+import step3
+import text_utils
+
+# A listing page with the same layout as the ones saved from empleo.gob.mx.
+SYNTHETIC_PAGE = """<!DOCTYPE html>
+<html><head><title>Oferta de empleo</title>
+<meta property="og:url" content="https://www.empleo.gob.mx//detalleoferta?id={listing_id}"/>
+<script>var ofertas = [{padding}];</script></head>
+<body><div><div>Inicio</div><div>Buscar</div><div>Ofertas</div><div>Ayuda</div>
+<div>Contacto</div><div>Avisos</div><div>Mapa</div>
+<div><div><div><h3>Oferta <small>{name}</small></h3></div></div><div></div><div></div>
+<div><div><div></div><div><div>
+<div><div><div><span>${salary:,}.00</span></div></div></div>
+<div><div><div><span>{state}, {municipality}</span></div></div></div>
+<div><div><div><span>Licenciatura</span></div></div></div>
+<div><div><div><span>Tiempo completo</span></div></div></div>
+<div><div><div><span>{days}</span></div></div></div>
+<div><div><div><span>{hours}</span></div></div></div>
+</div></div></div></div></div>
+<div>Secretaría del Trabajo y Previsión Social {padding}</div></div></body></html>"""
+
+# The footer, menus and scripts at the end of the real pages.
+SYNTHETIC_FOOTER = """<div><ul>{}</ul></div><script>{}</script>""".format(
+    "<li><a href='/ayuda'>Secretaría del Trabajo y Previsión Social</a></li>" * 800,
+    "var servicio = {};" * 5000)
+
+SYNTHETIC_NAMES = ["AYUDANTE GENERAL - SIN NOMBRE", "Ingeniero Industrial - Aceros del Norte",
+                   "Diseñador Gráfico - Estudio Creativo", "Guardia de Seguridad - Protección Total"]
+
+SYNTHETIC_LOCATIONS = [("Jalisco", "Zapopan"), ("Ciudad de México", "Cuauhtémoc"),
+                       ("Nuevo León", "Monterrey"), ("Guanajuato", "León")]
+
+# The number of pages used by the parsing benchmarks.
+PARSE_CORPUS_SIZE = 50000
+
+# The dataset included in the repository.
+DATASET_FILE = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "data", "data.csv")
+
+# The accent marks replaced by the clean_word function before text_utils.
+OLD_ACCENT_MARKS = ["á", "Á", "é", "É", "í", "Í", "ó", "Ó", "ú", "Ú"]
+OLD_FRIENDLY_MARKS = ["a", "A", "e", "E", "i", "I", "o", "O", "u", "U"]
+
+
+def create_page(listing_id):
+    """Creates the HTML of a synthetic listing page.
+
+    Parameters
+    ----------
+    listing_id : int
+        The listing id used in the page url.
+
+    Returns
+    -------
+    str
+        The page HTML.
+
+    """
+
+    state, municipality = random.choice(SYNTHETIC_LOCATIONS)
+
+    return SYNTHETIC_PAGE.format(
+        listing_id=listing_id, name=random.choice(SYNTHETIC_NAMES),
+        salary=random.randint(3000, 40000), state=state, municipality=municipality,
+        days="L, Ma, Mi, J, V", hours="09:00 a 18:00", padding="0, " * 2000)
+
+
+def create_corpus(folder, files_count):
+    """Writes synthetic listing pages into the specified folder.
+
+    Parameters
+    ----------
+    folder : str
+        The folder where the pages are saved.
+
+    files_count : int
+        The number of pages to create.
+
+    Returns
+    -------
+    list
+        The paths of the created pages.
+
+    """
+
+    random.seed(0)
+    files_list = list()
+
+    for listing_id in range(files_count):
+        file_name = os.path.join(folder, "{}.html".format(listing_id))
+
+        with open(file_name, "w", encoding="utf-8") as temp_file:
+            temp_file.write(create_page(listing_id))
+
+        files_list.append(file_name)
+
+    return files_list
+
+
+def benchmark_seen_ids():
+    """Compares the old per-link os.listdir check against the seen ids set
+    while the state folder grows to 100k+ files.
+    """
+
+    # A results page shows around 50 listings, most of them already saved.
+    links_count = 50
+
+    for files_count in [1000, 10000, 50000, 100000, 150000]:
+
+        state_folder = tempfile.mkdtemp() + "/"
+
+        try:
+            for listing_id in range(files_count):
+                open("{}{}.html".format(state_folder, listing_id), "w").close()
+
+            links = [str(x) for x in range(files_count - links_count // 2,
+                                           files_count + links_count // 2)]
+
+            start = time.perf_counter()
+
+            for listing_id in links:
+                listing_id + ".html" not in os.listdir(state_folder)
+
+            listdir_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            seen_ids = scraper.load_seen_ids(state_folder)
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+
+            for listing_id in links:
+                listing_id not in seen_ids
+
+            lookup_time = time.perf_counter() - start
+
+            print("{:>7,} files | listdir per link: {:8.4f}s | seen ids load: {:8.4f}s | seen ids lookups: {:8.6f}s".format(
+                files_count, listdir_time, load_time, lookup_time))
+
+        finally:
+            shutil.rmtree(state_folder)
+
+
+def old_extract_listing(html_text):
+    """The absolute XPath strings evaluated from the document root, as used before the extractor module."""
+
+    html = lxml.html.fromstring(html_text)
+    prefix = "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[{}]/div/div/span"
+
+    return (html.xpath(prefix.format(1))[0].text,
+            html.xpath("/html/body/div[1]/div[8]/div[1]/div/h3/small")[0].text,
+            html.xpath(prefix.format(2))[0].text,
+            html.xpath("//meta[@property='og:url']/@content")[0],
+            html.xpath(prefix.format(6))[0].text,
+            html.xpath(prefix.format(5))[0].text)
+
+
+def benchmark_extractor():
+    """Compares the per-page time of the absolute XPath strings against the precompiled
+    and relative expressions of the extractor module.
+    """
+
+    random.seed(0)
+    small_pages = [create_page(listing_id) for listing_id in range(2000)]
+
+    # Full size pages have the footer after the listing details.
+    full_pages = [x.replace("</div></body>", SYNTHETIC_FOOTER + "</div></body>")
+                  for x in small_pages]
+
+    for pages_name, pages in [("small pages", small_pages), ("full pages", full_pages)]:
+
+        for name, function in [("absolute xpath", old_extract_listing),
+                               ("extractor", extractor.extract_listing)]:
+
+            start = time.perf_counter()
+
+            for html_text in pages:
+                function(html_text)
+
+            elapsed = time.perf_counter() - start
+
+            print("{:<11} ({:>6,} chars) | {:<15} | {:8.1f}us per page".format(
+                pages_name, len(pages[0]), name, elapsed / len(pages) * 1e6))
+
+
+def benchmark_parse_workers():
+    """Measures the parsing throughput of the step2.py process pool with 1, 2, 4 and N workers."""
+
+    folder = tempfile.mkdtemp()
+
+    try:
+        files_list = create_corpus(folder, PARSE_CORPUS_SIZE)
+
+        for workers in sorted({1, 2, 4, os.cpu_count()}):
+
+            start = time.perf_counter()
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(listings_store.extract_listing,
+                                  files_list, chunksize=100))
+
+            elapsed = time.perf_counter() - start
+
+            print("{:>3} workers | {:8.2f}s | {:10,.0f} files/sec".format(
+                workers, elapsed, len(files_list) / elapsed))
+
+    finally:
+        shutil.rmtree(folder)
+
+
+def create_master_list(listings_count):
+    """Creates a synthetic master_list sorted from highest to lowest salary.
+
+    Parameters
+    ----------
+    listings_count : int
+        The number of listings.
+
+    Returns
+    -------
+    list
+        The (salary, name, location, url) tuples.
+
+    """
+
+    random.seed(0)
+
+    offers = ["Ayudante General", "Ingeniero Industrial", "Diseñador Gráfico", "Guardia de Seguridad",
+              "Vendedor de Piso", "Auxiliar Contable", "Operador de Montacargas", "Cocinero"]
+
+    companies = ["SIN NOMBRE", "Aceros del Norte", "Estudio Creativo", "Protección Total",
+                 "Grupo Comercial {}", "Servicios {}"]
+
+    states = ["Jalisco", "Ciudad de México", "Nuevo León", "Guanajuato", "Yucatán", "Puebla"]
+
+    master_list = list()
+
+    for listing_id in range(listings_count):
+        name = "{} - {}".format(random.choice(offers),
+                                random.choice(companies).format(random.randint(1, 500)))
+        location = "{}, Municipio {}".format(
+            random.choice(states), random.randint(1, 200))
+
+        master_list.append((random.randint(3000, 40000), name, location,
+                            "https://www.empleo.gob.mx/detalleoferta?id={}".format(listing_id)))
+
+    master_list.sort(reverse=True, key=lambda tup: tup[0])
+
+    return master_list
+
+
+def old_clean_word(word):
+    """The clean_word function used by the scripts before text_utils, one str.replace per mark."""
+
+    for index, char in enumerate(OLD_ACCENT_MARKS):
+        word = word.replace(char, OLD_FRIENDLY_MARKS[index])
+
+    return word
+
+
+def linear_search(master_list, parameters, limit):
+    """The linear scan used by comments_bot.filter_posts before the QueryIndex."""
+
+    clean_word = old_clean_word
+    results = list()
+
+    for salary, name, location, url in master_list:
+
+        if len(results) >= limit:
+            break
+
+        if parameters["location"] in clean_word(location.lower()) or parameters["location"] in clean_word(name.lower()):
+
+            if parameters.get("minimum_salary"):
+                if salary < parameters["minimum_salary"]:
+                    continue
+
+                if parameters.get("maximum_salary") and salary > parameters["maximum_salary"]:
+                    continue
+
+                if parameters.get("tag") and parameters["tag"] not in clean_word(name.lower()):
+                    continue
+
+            results.append((salary, name, location, url))
+
+    return results
+
+
+def benchmark_query_index():
+    """Compares the QueryIndex of comments_bot against the linear scan on 10k and 100k listings."""
+
+    queries = [{"location": "jalisco"},
+               {"location": "mexico", "minimum_salary": 15000},
+               {"location": "leon", "minimum_salary": 8000, "maximum_salary": 12000},
+               {"location": "puebla", "minimum_salary": 5000, "tag": "contable"},
+               {"location": "yucatan", "minimum_salary": 5000,
+                   "maximum_salary": 9000, "tag": "cocinero"},
+               {"location": "ciudad de mexico", "minimum_salary": 35000,
+                   "maximum_salary": 36000, "tag": "montacargas"},
+               {"location": "municipio 199", "minimum_salary": 39000}]
+
+    for listings_count in [10000, 100000]:
+
+        master_list = create_master_list(listings_count)
+
+        start = time.perf_counter()
+        query_index = comments_bot.QueryIndex(snapshot.Window.from_listings(
+            [listings_store.create_listing(*listing) for listing in master_list]))
+        build_time = time.perf_counter() - start
+
+        for parameters in queries:
+
+            start = time.perf_counter()
+            expected = linear_search(
+                master_list, parameters, comments_bot.MAX_JOBS)
+            linear_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = query_index.search(parameters, comments_bot.MAX_JOBS)
+            index_time = time.perf_counter() - start
+
+            assert [x.url for x in results] == [x[3] for x in expected]
+
+            print("{:>7,} listings | {:<100} | linear: {:8.5f}s | index: {:8.5f}s".format(
+                listings_count, str(parameters), linear_time, index_time))
+
+        print("{:>7,} listings | index built in {:.3f}s".format(
+            listings_count, build_time))
+
+
+def benchmark_clean_word():
+    """Compares the per-call cost of the old clean_word against text_utils.clean_word
+    on the offer, state and municipality columns of the dataset, and against
+    text_utils.clean_location on the location texts built from them.
+    """
+
+    with open(DATASET_FILE, "r", encoding="utf-8") as temp_file:
+        rows = list(csv.DictReader(temp_file))
+
+    columns = {column: [row[column] for row in rows] for column in ["offer", "state", "municipality"]}
+    columns["location"] = ["{}, {}".format(row["state"], row["municipality"]).lower() for row in rows]
+
+    for column, values in columns.items():
+
+        start = time.perf_counter()
+
+        for value in values:
+            old_clean_word(value)
+
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+
+        for value in values:
+            text_utils.clean_word(value)
+
+        translate_time = time.perf_counter() - start
+
+        text_utils.clean_location.cache_clear()
+        start = time.perf_counter()
+
+        for value in values:
+            text_utils.clean_location(value)
+
+        cached_time = time.perf_counter() - start
+
+        print("{:<12} | {:,} values | str.replace: {:6.0f}ns | str.translate: {:6.0f}ns | cached: {:6.0f}ns".format(
+            column, len(values), old_time / len(values) * 1e9,
+            translate_time / len(values) * 1e9, cached_time / len(values) * 1e9))
+
+
+def old_median_by_profession(df):
+    """The per-offer boolean mask loop used by step3.generate_median_by_profession before."""
+
+    temp_list = list()
+
+    for item, count in df["offer"].value_counts()[:].items():
+        median_salary = df[df["offer"] == item]["salary"].median()
+        temp_list.append([item, int(median_salary), count])
+
+    return temp_list
+
+
+def benchmark_median_by_profession():
+    """Compares the grouped aggregation of step3.generate_median_by_profession against the
+    old per-offer loop, on the dataset and on copies of it up to a year of listings.
+    """
+
+    dataset_df = pd.read_csv(DATASET_FILE, parse_dates=["date"])
+    folder = tempfile.mkdtemp()
+    current_folder = os.getcwd()
+
+    # The function saves medians.csv in the current folder.
+    os.chdir(folder)
+
+    try:
+        for months in [1, 3, 12]:
+
+            df = pd.concat([dataset_df] * months, ignore_index=True)
+
+            start = time.perf_counter()
+            step3.generate_median_by_profession(df)
+            grouped_time = time.perf_counter() - start
+
+            # The old loop takes minutes on a year of listings.
+            if months <= 3:
+                start = time.perf_counter()
+                old_median_by_profession(df)
+                old_time = "{:8.2f}s".format(time.perf_counter() - start)
+            else:
+                old_time = "skipped"
+
+            print("{:>2} months | {:>9,} rows | loop: {:>9} | groupby: {:8.2f}s".format(
+                months, len(df), old_time, grouped_time))
+
+    finally:
+        os.chdir(current_folder)
+        shutil.rmtree(folder)
+
+
+def old_prepare_post(master_list):
+    """The full sort and string concatenation used by post_bot.prepare_post before build_digest."""
+
+    message = post_bot.DIGEST_HEADER
+    master_list.sort(reverse=True, key=lambda listing: listing.salary)
+
+    for listing in master_list:
+        if listing.salary >= post_bot.MIN_SALARY_THRESHOLD:
+            if len(message) <= post_bot.MAX_DIGEST_LENGTH:
+                message += listing.row
+
+    return message
+
+
+def benchmark_digest():
+    """Compares post_bot.build_digest against the old full sort on 10k and 100k listings,
+    the old code sorted and concatenated every listing on every run.
+    """
+
+    for listings_count in [10000, 100000]:
+
+        listings = [listings_store.create_listing(*listing)
+                    for listing in create_master_list(listings_count)]
+        random.shuffle(listings)
+
+        start = time.perf_counter()
+        old_message = old_prepare_post(list(listings))
+        old_time = time.perf_counter() - start
+
+        # Without a snapshot post_bot sorts the master_list once and reads it in order.
+        start = time.perf_counter()
+        listings.sort(reverse=True, key=lambda listing: listing.salary)
+        message = post_bot.build_digest(snapshot.Window.from_listings(listings))
+        digest_time = time.perf_counter() - start
+
+        print("{:>7,} listings | full sort: {:.4f}s | build_digest: {:.4f}s | same digest: {}".format(
+            listings_count, old_time, digest_time, message == old_message))
+
+
+def benchmark_snapshot():
+    """Compares creating the master_list from the listings store against opening the
+    snapshot and building the digest from it, on 10k and 100k listings.
+    """
+
+    for listings_count in [10000, 100000]:
+
+        master_list = create_master_list(listings_count)
+        folder = tempfile.mkdtemp()
+        store_file = os.path.join(folder, "listings.db")
+        files_list = ["./states/1/{}.html".format(x) for x in range(listings_count)]
+
+        try:
+            connection = listings_store.connect(store_file)
+
+            connection.executemany("INSERT INTO listings (path, mtime, salary, name, location, url) VALUES (?, 0, ?, ?, ?, ?)",
+                                   [(file_name,) + listing for file_name, listing in zip(files_list, master_list)])
+            connection.commit()
+
+            # The bots read the stored values and create every Listing.
+            start = time.perf_counter()
+            query = "SELECT salary, name, location, url FROM listings WHERE path IN ({})"
+            listings = list()
+
+            for index in range(0, len(files_list), listings_store.QUERY_CHUNK_SIZE):
+                chunk = files_list[index:index + listings_store.QUERY_CHUNK_SIZE]
+
+                for values in connection.execute(query.format(", ".join("?" * len(chunk))), chunk):
+                    listings.append(listings_store.get_listing(values))
+
+            listings.sort(reverse=True, key=lambda listing: listing.salary)
+            store_time = time.perf_counter() - start
+
+            snapshot.write_snapshot(listings, [time.time()] * listings_count,
+                                    0, folder + "/snapshot/")
+
+            # The snapshot is opened and the digest only decodes the listings it shows.
+            start = time.perf_counter()
+            loaded = snapshot.Snapshot(folder + "/snapshot/")
+            window = snapshot.Window(loaded, np.flatnonzero(loaded.timestamps >= 0), list())
+            post_bot.build_digest(window)
+            snapshot_time = time.perf_counter() - start
+
+            # The comments_bot index also decodes the search texts.
+            start = time.perf_counter()
+            comments_bot.QueryIndex(window)
+            index_time = time.perf_counter() - start
+
+            print("{:>7,} listings | store: {:.3f}s | snapshot and digest: {:.3f}s | query index: {:.3f}s | same listings: {}".format(
+                listings_count, store_time, snapshot_time, index_time, listings == list(window)))
+
+        finally:
+            connection.close()
+            shutil.rmtree(folder)
+
+
+def benchmark_load_dataset():
+    """Compares the default pandas.read_csv against step3.load_dataset (first load and
+    Parquet copy) on copies of the dataset up to a year of listings.
+    """
+
+    folder = tempfile.mkdtemp()
+    file_path = os.path.join(folder, "data.csv")
+
+    with open(DATASET_FILE, "r", encoding="utf-8") as temp_file:
+        header = temp_file.readline()
+        rows = temp_file.read()
+
+    try:
+        for months in [1, 3, 12]:
+
+            with open(file_path, "w", encoding="utf-8") as temp_file:
+                temp_file.write(header + rows * months)
+
+            start = time.perf_counter()
+            df = pd.read_csv(file_path, parse_dates=["date"])
+            default_time = time.perf_counter() - start
+            default_memory = df.memory_usage(deep=True).sum() / 1024 ** 2
+
+            start = time.perf_counter()
+            step3.load_dataset(file_path)
+            first_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            df = step3.load_dataset(file_path)
+            cached_time = time.perf_counter() - start
+            typed_memory = df.memory_usage(deep=True).sum() / 1024 ** 2
+
+            print("{:>2} months | {:>9,} rows | read_csv: {:.2f}s {:7.1f} MB | load_dataset: {:.2f}s, cached {:.2f}s {:7.1f} MB".format(
+                months, len(df), default_time, default_memory, first_time, cached_time, typed_memory))
+
+    finally:
+        shutil.rmtree(folder)
+
+
+BENCHMARKS = {
+    "seen_ids": benchmark_seen_ids,
+    "extractor": benchmark_extractor,
+    "parse_workers": benchmark_parse_workers,
+    "query_index": benchmark_query_index,
+    "clean_word": benchmark_clean_word,
+    "median_by_profession": benchmark_median_by_profession,
+    "digest": benchmark_digest,
+    "snapshot": benchmark_snapshot,
+    "load_dataset": benchmark_load_dataset
+}
+
+
+if __name__ == "__main__":
+
+    for name in sys.argv[1:] or BENCHMARKS.keys():
+        print("Running:", name)
+        BENCHMARKS[name]()
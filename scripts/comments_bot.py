@@ -1,22 +1,48 @@
 """
 This is a Reddit bot that answers to users who use the !empleos command.
 It keeps track of which comments it has answered.
+
+By default it checks every comment of the monitored threads once and exits. With --daemon it
+keeps running: the listings index stays in memory and is only updated with the new log
+entries, and the new comments are read from the subreddit comment stream.
 """
 
-import concurrent.futures
+import argparse
+import collections
+import fcntl
+import functools
+import os
+import queue
+import sqlite3
+import statistics
+import threading
+import time
 from datetime import datetime, timedelta
 
-import lxml.html
+import numpy as np
 import praw
+import prawcore
 
 import config
+import extractor
+import listings_store
+import log_reader
+import snapshot
+import text_utils
+
+# The file path where the processed comments are saved.
+COMMENTS_STORE_FILE = "comments.db"
 
-# The file path where the log is saved.
+# The plain text log used by previous versions, it is imported once into the store.
 COMMENTS_LOG_FILE = "comments_log.txt"
 
-# The next 2 lists must have the same length, since one will replace the other.
-ACCENT_MARKS = ["á", "Á", "é", "É", "í", "Í", "ó", "Ó", "ú", "Ú"]
-FRIENDLY_MARKS = ["a", "A", "e", "E", "i", "I", "o", "O", "u", "U"]
+# Only one instance of the bot runs at a time, a cron run may still be waiting for the
+# rate limit when the next one starts.
+INSTANCE_LOCK_FILE = "comments_bot.lock"
+
+# A comment is marked as pending before replying and as done after replying.
+PENDING = 0
+DONE = 1
 
 # Error messages
 NO_JOBS_MESSAGE = "Lo siento. No pude encontrar ofertas con los parámetros especificados."
@@ -24,77 +50,534 @@ NO_JOBS_MESSAGE = "Lo siento. No pude encontrar ofertas con los parámetros espe
 # To avoid hitting the 10,000 charater limit in comments we only return up to 10 jobs.
 MAX_JOBS = 10
 
+# The number of listings checked directly before a query uses the token index.
+SCAN_LENGTH = 2000
+
+# The number of rendered replies kept in memory, most users ask for the same few queries.
+REPLY_CACHE_SIZE = 256
+
+# In daemon mode, the seconds between requests when there aren't new comments.
+POLL_INTERVAL = 3
+
+# In daemon mode, the seconds to wait before reconnecting after a Reddit API error.
+RETRY_INTERVAL = 30
+
+# Failed replies are retried with an exponential backoff.
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 2
+
+
+# The version of the listings in memory, it changes every time the window changes.
+snapshot_version = 0
+
+# The index of the master_list, it's built by the first query after the listings change.
+query_index = None
+
 
 def load_files():
-    """Reads the log file and discards the files that are older than the JOB_MAX_AGE."""
+    """Reads the log file entries that are no older than the JOBS_MAX_AGE."""
 
     now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
-    now_timestamp = now.timestamp()
 
-    with open("log.txt", "r", encoding="utf-8") as temp_file:
+    # The log is ordered by time, the start of the window is found with a binary search.
+    return log_reader.load_window(now.timestamp() - config.JOBS_MAX_AGE)
+
 
-        files_list = list()
+def parse_file(listing):
+    """Takes the values of interest from a stored listing and adds them to the master_list.
 
-        for item in temp_file.read().splitlines():
+    Parameters
+    ----------
+    listing : tuple
+        The listing values, in the same order as listings_store.FIELDS.
 
-            file_name, file_date = item.split(",")
+    """
 
-            file_timestamp = datetime.strptime(
-                file_date, "%Y-%m-%d %H:%M:%S.%f").timestamp()
+    # The offer, company, search fields and table row are computed once here
+    # instead of on every query.
+    listing = listings_store.get_listing(listing)
 
-            if (now_timestamp - file_timestamp) <= config.JOBS_MAX_AGE:
-                files_list.append(file_name)
+    if listing is not None:
+        master_list.append(listing)
 
-        return files_list
 
+class QueryIndex:
+    """An index of the master_list built by the first !empleos query of each run.
 
-def parse_file(file_name):
-    """Parses a .html file and extracts values of interest using lxml.
+    The normalised location and name of each listing are split into tokens, each token
+    has a posting list with the ids (positions) of the listings that contain it. Since the
+    master_list is sorted by salary, lower ids mean higher salaries and the salary range
+    is found with a binary search on a NumPy array of the salaries.
 
     Parameters
     ----------
-    file_name : str
-        The name of the file to be parsed.
+    listings : snapshot.Window
+        The master_list, sorted from highest to lowest salary.
 
     """
 
-    with open(file_name, "r", encoding="utf-8") as temp_file:
+    def __init__(self, listings):
+        self.listings = listings
 
-        # Very few times the HTML is corrupted and can't fixed.
-        try:
-            html = lxml.html.fromstring(temp_file.read())
+        # Only the search texts are decoded, the listings are decoded for the results.
+        self.salaries = listings.salaries
+        self.location_texts = listings.get_column("location_text")
+        self.name_texts = listings.get_column("name_text")
+        self.location_postings = dict()
+        self.name_postings = dict()
+
+        for listing_id, location_text in enumerate(self.location_texts):
+            for token in location_text.split():
+                self.location_postings.setdefault(token, set()).add(listing_id)
+
+        for listing_id, name_text in enumerate(self.name_texts):
+            for token in name_text.split():
+                self.name_postings.setdefault(token, set()).add(listing_id)
+
+        self.candidates_cache = dict()
+
+    def get_candidates(self, postings, word):
+        """Gets the ids of the listings with at least one token that contains the word.
+
+        Parameters
+        ----------
+        postings : dict
+            The token posting lists of the field to search.
+
+        word : str
+            A word without white space.
+
+        Returns
+        -------
+        set
+            The ids of the listings that contain the word.
+
+        """
+
+        key = (id(postings), word)
+
+        if key not in self.candidates_cache:
+
+            candidates = set()
+
+            # The parameters match partial words, we check every token of the field.
+            for token, listings_ids in postings.items():
+                if word in token:
+                    candidates.update(listings_ids)
+
+            self.candidates_cache[key] = candidates
+
+        return self.candidates_cache[key]
+
+    def get_phrase_candidates(self, postings, phrase):
+        """Gets the ids of the listings that may contain the phrase.
+
+        If a phrase is inside a text, each of its words is inside one of the text tokens.
+        The returned ids still need to be verified against the full text.
+
+        Parameters
+        ----------
+        postings : dict
+            The token posting lists of the field to search.
+
+        phrase : str
+            One or more words.
+
+        Returns
+        -------
+        set
+            The ids of the listings that may contain the phrase.
+
+        """
+
+        words = phrase.split()
+
+        if not words:
+            return self.get_candidates(postings, "")
+
+        candidates = self.get_candidates(postings, words[0])
+
+        for word in words[1:]:
+            candidates = candidates & self.get_candidates(postings, word)
+
+        return candidates
+
+    def search(self, parameters, limit=MAX_JOBS):
+        """Gets the listings that satisfy the parameters, from highest to lowest salary.
+
+        Parameters
+        ----------
+        parameters : dict
+            A dictionary containing the parameters to filter the master list.
+
+        limit : int
+            The maximum number of listings to return.
+
+        Returns
+        -------
+        list
+            The matching listings.
+
+        """
+
+        location = parameters["location"]
+        tag = None
+        low = 0
+        high = len(self.listings)
+
+        # The salaries and the tag are only used when a minimum salary is specified.
+        if parameters.get("minimum_salary"):
+            low, high = snapshot.get_salary_range(
+                self.salaries, parameters["minimum_salary"], parameters.get("maximum_salary") or None)
+
+            tag = parameters.get("tag")
+
+        results = list()
+
+        # Common queries find their listings near the start of the range, the texts are
+        # checked directly without building the candidate sets.
+        scan_end = min(high, low + SCAN_LENGTH)
+
+        for listing_id in range(low, scan_end):
+            if self.is_match(listing_id, location, tag):
+                results.append(self.listings[listing_id])
+
+                if len(results) >= limit:
+                    return results
+
+        if scan_end == high:
+            return results
+
+        # The matches are sparse, only the candidates in the rest of the range are checked.
+        candidates = self.get_phrase_candidates(self.location_postings, location) | \
+            self.get_phrase_candidates(self.name_postings, location)
+
+        if tag:
+            candidates = candidates & self.get_phrase_candidates(self.name_postings, tag)
+
+        for listing_id in sorted(x for x in candidates if scan_end <= x < high):
+            if self.is_match(listing_id, location, tag):
+                results.append(self.listings[listing_id])
+
+                if len(results) >= limit:
+                    break
+
+        return results
+
+    def is_match(self, listing_id, location, tag):
+        """Checks the location and the tag against the full texts of the listing."""
+
+        if location not in self.location_texts[listing_id] and location not in self.name_texts[listing_id]:
+            return False
+
+        return not tag or tag in self.name_texts[listing_id]
+
+
+class ListingsWindow:
+    """Keeps the listings of the JOBS_MAX_AGE window in memory for the daemon mode.
+
+    Each refresh only reads the log entries added since the previous one and drops the
+    listings that left the window. The master_list is rebuilt only when the window changed
+    and the query_index is then built again by the next query.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the listings store.
+
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.offset = None
+
+        # The (timestamp, listing) of each log entry inside the window, in log order.
+        # Entries with missing values are kept as None so they expire like the others.
+        self.entries = collections.deque()
+
+    def refresh(self):
+        """Reads the new log entries and updates the master_list.
+
+        Returns
+        -------
+        bool
+            True if the listings changed.
+
+        """
+
+        global master_list, query_index, snapshot_version
+
+        now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
+        cutoff_timestamp = now.timestamp() - config.JOBS_MAX_AGE
+        changed = False
+
+        # The first refresh starts at the window start, found with a binary search.
+        if self.offset is None:
+            self.offset = log_reader.find_window_offset(cutoff_timestamp)
+            changed = True
+
+        new_entries = list(log_reader.iter_log(self.offset))
+
+        if new_entries:
+            self.offset = new_entries[-1][2]
+            files_list = [file_name for file_name, _, _ in new_entries]
+
+            for (file_name, file_date, _), values in zip(new_entries, listings_store.load_listings(
+                    self.connection, files_list)):
+                self.entries.append((datetime.fromisoformat(file_date).timestamp(),
+                                     listings_store.get_listing(values)))
+
+            changed = True
+
+        while self.entries and self.entries[0][0] < cutoff_timestamp:
+            self.entries.popleft()
+            changed = True
+
+        if changed:
+            master_list = [listing for _, listing in self.entries
+                           if listing is not None]
+            master_list.sort(reverse=True, key=lambda listing: listing.salary)
+            master_list = snapshot.Window.from_listings(master_list)
+            query_index = None
+
+            # The cached replies were rendered with the previous listings, the version is
+            # part of their key and the LRU eviction removes them.
+            snapshot_version += 1
+
+        return changed
+
+
+def create_reddit():
+    """Creates the Reddit client with the credentials from the config module."""
+
+    return praw.Reddit(client_id=config.APP_ID, client_secret=config.APP_SECRET,
+                       user_agent=config.USER_AGENT, username=config.REDDIT_USERNAME,
+                       password=config.REDDIT_PASSWORD)
+
+
+def has_reply(comment):
+    """Checks if the bot already replied to the comment.
+
+    Parameters
+    ----------
+    comment : praw.models.Comment
+        The comment to check.
+
+    Returns
+    -------
+    bool
+        True if any of the comment replies was written by the bot.
+
+    """
+
+    # The replies are only loaded by a refresh.
+    comment.refresh()
+
+    for reply in comment.replies:
+        if reply.author is not None and reply.author.name.lower() == config.REDDIT_USERNAME.lower():
+            return True
+
+    return False
+
+
+def get_parameters(comment_body):
+    """Gets the parameters of a comment with the !empleos command.
+
+    Parameters
+    ----------
+    comment_body : str
+        The comment body, it starts with the !empleos command.
+
+    Returns
+    -------
+    dict
+        The parameters to filter the job listings.
+
+    """
+
+    if '"' in comment_body:
+        parameters_list = comment_body.lower().split("!empleos")
+        parameters = dict()
+        parameters["location"] = text_utils.clean_word(
+            parameters_list[1].replace('"', "").strip())
+    else:
+        parameters = parse_normal_comment(comment_body)
+
+    return parameters
+
+
+class ReplyScheduler:
+    """Computes the replies as the comments are found and sends them from a worker thread.
+
+    The replies are computed right away, comments with the same parameters share the
+    same cached reply. Sending them is slower (Reddit rate limits the bot), so they are queued
+    and a worker sends them in order, waiting when the rate limit is used up and retrying
+    failed replies with an exponential backoff.
+
+    Parameters
+    ----------
+    reddit : praw.Reddit
+        The Reddit client, its rate limit headers are checked before each reply.
+
+    comments_log : CommentsLog
+        The processed comments.
+
+    """
+
+    def __init__(self, reddit, comments_log):
+        self.reddit = reddit
+        self.comments_log = comments_log
 
-            salary = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[1]/div/div/span")[0].text
+        # The ids of the comments waiting in the queue.
+        self.scheduled = set()
 
-            clean_salary = int(float(salary.replace("$", "").replace(",", "")))
+        # The seconds between each comment creation and its reply.
+        self.latencies = list()
 
-            name = html.xpath(
-                "/html/body/div[1]/div[8]/div[1]/div/h3/small")[0].text
+        self.queue = queue.Queue()
+        threading.Thread(target=self.send_replies, daemon=True).start()
 
-            location = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[2]/div/div/span")[0].text
+    def schedule(self, comment):
+        """Computes the reply if the comment includes the !empleos command and valid
+        parameters, and adds it to the queue.
 
-            url = html.xpath(
-                "//meta[@property='og:url']/@content")[0].replace("x//", "x/")
+        Parameters
+        ----------
+        comment : praw.models.Comment
+            The comment to check.
 
-            master_list.append((clean_salary, name, location, url))
+        """
 
+        if comment.id in self.scheduled:
+            return
+
+        if self.comments_log.is_done(comment.id):
+            self.comments_log.update_legacy(comment)
+            return
+
+        # For a comment to be valid we start by checking that the command !empleos is in the comment body.
+        if not comment.body.lower().strip().startswith("!empleos"):
+            return
+
+        try:
+
+            # The bot stopped after or while replying to this comment, if the reply
+            # was posted we don't reply again.
+            if self.comments_log.is_pending(comment.id) and has_reply(comment):
+                self.comments_log.update(comment, DONE)
+                return
+
+            parameters = get_parameters(comment.body)
+            print(parameters)
+            message = get_reply(tuple(sorted(parameters.items())), snapshot_version)
         except:
-            pass
+            return
+
+        self.comments_log.update(comment, PENDING)
+        self.scheduled.add(comment.id)
+        self.queue.put((comment, message))
+
+    def wait_rate_limit(self):
+        """Sleeps until the rate limit resets if there are no requests left."""
+
+        limits = self.reddit.auth.limits
+
+        if limits.get("remaining") is not None and limits["remaining"] < 1:
+            time.sleep(max(limits["reset_timestamp"] - time.time(), 0))
+
+    def send_replies(self):
+        """Sends the queued replies, this runs in the worker thread."""
+
+        while True:
+
+            comment, message = self.queue.get()
+
+            # The worker must keep running, the comment stays pending and is checked
+            # on the next run.
+            try:
+                self.send_reply(comment, message)
+            except Exception as error:
+                print("Reply error:", comment.id, error)
+            finally:
+                self.scheduled.discard(comment.id)
+                self.queue.task_done()
+
+    def send_reply(self, comment, message):
+        """Sends a reply, retrying with an exponential backoff, and marks the comment as done."""
+
+        for attempt in range(MAX_RETRIES + 1):
 
+            try:
+                self.wait_rate_limit()
+                comment.reply(message)
+            except (praw.exceptions.RedditAPIException, prawcore.exceptions.PrawcoreException) as error:
+                print("Reply error:", error)
+                time.sleep(BACKOFF_FACTOR ** attempt)
+                continue
+            except:
+                # Other errors (a deleted comment for example) aren't retried,
+                # the comment stays pending and is checked on the next run.
+                return
+
+            self.comments_log.update(comment, DONE)
+
+            latency = time.time() - comment.created_utc
+            self.latencies.append(latency)
+            print("Replied: {} ({:.1f}s)".format(comment.id, latency))
+            return
+
+    def join(self):
+        """Waits until all the queued replies were sent."""
+
+        self.queue.join()
+
+    def print_metrics(self):
+        """Prints the number of replies, their latencies and the reply cache counters."""
+
+        if self.latencies:
+            print("Replies: {} | Median latency: {:.1f}s | Max latency: {:.1f}s".format(
+                len(self.latencies), statistics.median(self.latencies), max(self.latencies)))
+
+        cache_info = get_reply.cache_info()
+
+        print("Reply cache: {} hits | {} misses | {} of {} entries".format(
+            cache_info.hits, cache_info.misses, cache_info.currsize, cache_info.maxsize))
+
+
+def lock_instance():
+    """Takes the single instance lock, it's held until the process exits.
+
+    Returns
+    -------
+    file
+        The open lock file, or None if another instance holds the lock.
 
-def load_comments():
-    """Loads the latest comments and replies to those who
-    include the !empleos command and valid parameters.
     """
 
-    # We initialize Reddit.
-    reddit = praw.Reddit(client_id=config.APP_ID, client_secret=config.APP_SECRET,
-                         user_agent=config.USER_AGENT, username=config.REDDIT_USERNAME,
-                         password=config.REDDIT_PASSWORD)
+    lock_file = open(INSTANCE_LOCK_FILE, "a")
+
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+
+    return lock_file
 
-    processed_comments = load_log()
+
+def load_comments(reddit, scheduler):
+    """Loads all the comments of the monitored threads and schedules the replies to
+    those who include the !empleos command and valid parameters.
+
+    Parameters
+    ----------
+    reddit : praw.Reddit
+        The Reddit client.
+
+    scheduler : ReplyScheduler
+        The scheduler that computes and sends the replies.
+
+    """
 
     for post_id in config.SUBMISSION_IDS:
         submission = reddit.submission(id=post_id)
@@ -103,34 +586,86 @@ def load_comments():
         submission.comments.replace_more(limit=None)
 
         for comment in submission.comments.list():
+            scheduler.schedule(comment)
+
+    # Every imported comment still in a monitored thread got its thread, the rest are
+    # no longer needed.
+    scheduler.comments_log.prune_legacy()
+
+
+def stream_comments(reddit, scheduler, listings_window):
+    """Replies to the new comments of the monitored threads as they arrive.
+
+    The comments are read from the stream of the subreddits of the monitored threads,
+    each request only asks for the comments newer than the last one seen.
+
+    Parameters
+    ----------
+    reddit : praw.Reddit
+        The Reddit client.
+
+    scheduler : ReplyScheduler
+        The scheduler that computes and sends the replies.
+
+    listings_window : ListingsWindow
+        The listings in memory, refreshed while there aren't new comments.
 
-            if comment.id not in processed_comments:
+    """
+
+    subreddits = sorted({reddit.submission(id=post_id).subreddit.display_name
+                         for post_id in config.SUBMISSION_IDS})
+
+    # The link_id of a comment is the thread fullname, like t3_938fpu.
+    link_ids = {"t3_" + post_id for post_id in config.SUBMISSION_IDS}
+
+    for comment in reddit.subreddit("+".join(subreddits)).stream.comments(pause_after=0):
+
+        # The stream yields None when there aren't new comments.
+        if comment is None:
+            if listings_window.refresh():
+                print("Listings:", len(master_list))
+
+                # The new files are usually parsed by this bot first.
+                extractor.print_report(reset=True)
+
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        if comment.link_id in link_ids:
+            scheduler.schedule(comment)
 
-                # For a comment to be valid we start by checking that the command !empleos is in the comment body.
-                if comment.body.lower().strip().startswith("!empleos"):
 
-                    try:
+def run_daemon(reddit, connection):
+    """Keeps answering the new comments, the listings index stays in memory.
 
-                        if '"' in comment.body:
-                            parameters_list = comment.body.lower().split("!empleos")
-                            parameters = dict()
-                            parameters["location"] = clean_word(
-                                parameters_list[1].replace('"', "").strip())
-                        else:
-                            parameters = parse_normal_comment(comment.body)
+    Parameters
+    ----------
+    reddit : praw.Reddit
+        The Reddit client.
+
+    connection : sqlite3.Connection
+        The connection to the listings store.
+
+    """
+
+    listings_window = ListingsWindow(connection)
+    listings_window.refresh()
+    extractor.print_report(reset=True)
 
-                        print(parameters)
-                        message, job_counter = filter_posts(parameters)
+    scheduler = ReplyScheduler(reddit, CommentsLog())
+
+    try:
+        while True:
 
-                        # If there were no jobs we reply with an error message.
-                        if job_counter == 0:
-                            comment.reply(NO_JOBS_MESSAGE)
-                            update_log(comment.id)
-                        else:
-                            comment.reply(message)
-                            update_log(comment.id)
-                    except:
-                        pass
+            try:
+                # The comments posted while the bot wasn't running are answered first.
+                load_comments(reddit, scheduler)
+                stream_comments(reddit, scheduler, listings_window)
+            except (praw.exceptions.PRAWException, prawcore.exceptions.PrawcoreException) as error:
+                print("Reddit error:", error)
+                time.sleep(RETRY_INTERVAL)
+    finally:
+        scheduler.print_metrics()
 
 
 def parse_normal_comment(comment_body):
@@ -157,32 +692,59 @@ def parse_normal_comment(comment_body):
     # The parameters list can have up to 5 items, including the command.
     # We check for each escneario and clean the data accordingly.
     if len(parameters_list) == 2:
-        parameters["location"] = clean_word(str(parameters_list[1]))
+        parameters["location"] = text_utils.clean_word(str(parameters_list[1]))
 
     elif len(parameters_list) == 3:
-        parameters["location"] = clean_word(str(parameters_list[1]))
+        parameters["location"] = text_utils.clean_word(str(parameters_list[1]))
         parameters["minimum_salary"] = int(parameters_list[2])
 
     elif len(parameters_list) == 4:
-        parameters["location"] = clean_word(str(parameters_list[1]))
+        parameters["location"] = text_utils.clean_word(str(parameters_list[1]))
         parameters["minimum_salary"] = int(parameters_list[2])
 
         try:
             parameters["maximum_salary"] = int(parameters_list[3])
         except:
-            parameters["tag"] = clean_word(str(parameters_list[3]))
+            parameters["tag"] = text_utils.clean_word(str(parameters_list[3]))
 
     elif len(parameters_list) == 5:
-        parameters["location"] = clean_word(str(parameters_list[1]))
+        parameters["location"] = text_utils.clean_word(str(parameters_list[1]))
         parameters["minimum_salary"] = int(parameters_list[2])
         parameters["maximum_salary"] = int(parameters_list[3])
-        parameters["tag"] = clean_word(str(parameters_list[4]))
+        parameters["tag"] = text_utils.clean_word(str(parameters_list[4]))
 
     return parameters
 
 
+@functools.lru_cache(maxsize=REPLY_CACHE_SIZE)
+def get_reply(parameters_key, version):
+    """Gets the reply message for the parameters, identical queries reuse the rendered reply.
+
+    The hits and misses are available with get_reply.cache_info().
+
+    Parameters
+    ----------
+    parameters_key : tuple
+        The sorted (name, value) pairs of the parameters.
+
+    version : int
+        The snapshot_version of the listings, replies of older versions are never reused.
+
+    Returns
+    -------
+    str
+        The Reddit reply message formatted with Markdown.
+
+    """
+
+    message, job_counter = filter_posts(dict(parameters_key))
+
+    # If there were no jobs we reply with an error message.
+    return message if job_counter else NO_JOBS_MESSAGE
+
+
 def filter_posts(parameters):
-    """Creates a folder if it doesn't exist.
+    """Creates the reply message with the listings that satisfy the parameters.
 
     Parameters
     ----------
@@ -203,132 +765,204 @@ def filter_posts(parameters):
     message = "Oferta | Empresa | Salario Neto Mensual | Ubicación\n--|--|--|--\n"
     job_counter = 0
 
-    # We unpack the tuples from the master_list.
-    for salary, name, location, url in master_list:
+    global query_index
 
-        # We set the job_match flag to false. This is used to avoid duplicating code.
-        job_match = False
+    # Most runs don't find new commands, the index is only built for the first query.
+    if query_index is None:
+        query_index = QueryIndex(master_list)
 
-        # Keep reading from the master_list only if we don't have reached the limit.
-        if job_counter < MAX_JOBS:
+    # The index returns the matching listings, already sorted by salary.
+    for listing in query_index.search(parameters, MAX_JOBS):
+        message += listing.row
+        job_counter += 1
 
-            # The first check is to know if our location is available in the master_list.
-            if parameters["location"] in clean_word(location.lower()) or parameters["location"] in clean_word(name.lower()):
+    # We finalize the mssage with the footer.
+    now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
 
-                # We then separate and clean the job name and the company name.
-                offer = name.split("-")[0].title().strip()
-                company = name.split("-")[-1].strip()
+    message += """\n*****\n^Ofertas ^obtenidas ^el: ^{:%d-%m-%Y ^a ^las ^%H:%M:%S} ^|
+        ^[Ayuda](https://redd.it/93au4i) ^|
+        ^[Contacto](https://www.reddit.com/message/compose/?to=agent_phantom) ^|
+        ^[GitHub](https://git.io/fNoyw)""".format(now)
 
-                if "sin nombre" in company.lower():
-                    company = "S/N"
-                else:
-                    company = company.title()
+    return (message, job_counter)
 
-                # This is where things start getting messy. Since we don't know which parameters
-                # are available, we first check for the escenario where we get all of them and
-                # Keep falling back until the one where we only have the location.
-                if parameters.get("minimum_salary") and parameters.get("maximum_salary") and parameters.get("tag"):
-                    if salary >= parameters["minimum_salary"] and salary <= parameters["maximum_salary"] and parameters["tag"] in clean_word(name.lower()):
-                        job_match = True
 
-                elif parameters.get("minimum_salary") and parameters.get("tag"):
-                    if salary >= parameters["minimum_salary"] and parameters["tag"] in clean_word(name.lower()):
-                        job_match = True
+class CommentsLog:
+    """The comments the bot has processed, saved in a SQLite database.
 
-                elif parameters.get("minimum_salary") and parameters.get("maximum_salary"):
-                    if salary >= parameters["minimum_salary"] and salary <= parameters["maximum_salary"]:
-                        job_match = True
+    The comment ids are base 36 numbers, they are saved as integers together with the
+    thread they belong to. The comments of threads that are no longer monitored are
+    removed when the log is opened. All the ids are loaded into sets, so checking a
+    comment doesn't depend on the number of processed comments.
 
-                elif parameters.get("minimum_salary"):
-                    if salary >= parameters["minimum_salary"]:
-                        job_match = True
+    The comments imported from the text log don't have a thread, it's saved when they
+    are seen again and the ones not found in any monitored thread are removed.
 
-                else:
-                    job_match = True
+    Parameters
+    ----------
+    store_file : str
+        The path of the SQLite database.
 
-            # If the current listing satisfies our parameters we add it to the table.
-            if job_match:
-                message += "[{}]({}) | {} | ${:,} | {}\n".format(
-                    offer, url, company, salary, location)
+    """
 
-                job_counter += 1
+    def __init__(self, store_file=COMMENTS_STORE_FILE):
 
-    # We finalize the mssage with the footer.
-    now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
+        # The replies are sent from another thread, the lock protects the connection.
+        self.connection = sqlite3.connect(store_file, check_same_thread=False)
+        self.lock = threading.Lock()
 
-    message += """\n*****\n^Ofertas ^obtenidas ^el: ^{:%d-%m-%Y ^a ^las ^%H:%M:%S} ^|
-        ^[Ayuda](https://redd.it/93au4i) ^|
-        ^[Contacto](https://www.reddit.com/message/compose/?to=agent_phantom) ^|
-        ^[GitHub](https://git.io/fNoyw)""".format(now)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY, thread TEXT, status INTEGER NOT NULL)""")
 
-    return (message, job_counter)
+        self.import_text_log()
 
+        # The comments imported from the text log don't have a thread, they are kept
+        # until the monitored threads are checked.
+        self.connection.execute("DELETE FROM comments WHERE thread NOT IN ({})".format(
+            ", ".join("?" * len(config.SUBMISSION_IDS))), config.SUBMISSION_IDS)
 
-def load_log():
-    """Loads the comments log. If it doesn't exist it creates it and returns an empty list.
+        self.connection.commit()
 
-    Returns
-    -------
+        self.done = set()
+        self.pending = set()
+        self.legacy = set()
 
-    list
-        A list containing all the processed comments.
+        for comment_id, thread, status in self.connection.execute(
+                "SELECT id, thread, status FROM comments"):
+            if status == DONE:
+                self.done.add(comment_id)
+            else:
+                self.pending.add(comment_id)
 
-    """
+            if thread is None:
+                self.legacy.add(comment_id)
 
-    try:
-        with open(COMMENTS_LOG_FILE, "r", encoding="utf-8") as temp_file:
-            return [x for x in temp_file.read().split("\n")]
+    def import_text_log(self):
+        """Imports the comments log of previous versions and renames it so it's only imported once."""
 
-    except:
-        with open(COMMENTS_LOG_FILE, "w", encoding="utf-8") as temp_file:
-            return list()
+        try:
+            with open(COMMENTS_LOG_FILE, "r", encoding="utf-8") as temp_file:
+                comments_ids = [x.strip() for x in temp_file if x.strip()]
+        except FileNotFoundError:
+            return
 
+        self.connection.executemany("INSERT OR IGNORE INTO comments VALUES (?, NULL, ?)",
+                                    [(int(x, 36), DONE) for x in comments_ids])
+        self.connection.commit()
 
-def update_log(comment_id):
-    """Updates the log file with the specified comment_id.
+        os.replace(COMMENTS_LOG_FILE, COMMENTS_LOG_FILE + ".imported")
 
-    Parameters
-    ----------
-    post_id : str
-        The specified Reddit comment id.
+    def update_legacy(self, comment):
+        """Saves the thread of a comment imported from the text log, if it's one of them."""
 
-    """
+        comment_id = int(comment.id, 36)
 
-    with open(COMMENTS_LOG_FILE, "a", encoding="utf-8") as temp_file:
-        temp_file.write("{}\n".format(comment_id))
+        if comment_id not in self.legacy:
+            return
 
+        with self.lock:
+            self.connection.execute("UPDATE comments SET thread = ? WHERE id = ?",
+                                    (comment.link_id.split("_")[-1], comment_id))
+            self.connection.commit()
 
-def clean_word(word):
-    """Cleans the word by replacing non-friendly characters.
+        self.legacy.discard(comment_id)
 
-    Parameters
-    ----------
-    word : str
-        The word to be cleaned.
+    def prune_legacy(self):
+        """Removes the imported comments that weren't seen, it must be called after all
+        the comments of the monitored threads were checked.
+        """
 
-    Returns
-    -------
-    str
-        The cleaned word.
+        if not self.legacy:
+            return
 
-    """
+        with self.lock:
+            self.connection.execute("DELETE FROM comments WHERE thread IS NULL")
+            self.connection.commit()
+
+        self.done -= self.legacy
+        self.pending -= self.legacy
+        self.legacy.clear()
+
+    def is_done(self, comment_id):
+        """Checks if the comment was already answered."""
 
-    for index, char in enumerate(ACCENT_MARKS):
-        word = word.replace(char, FRIENDLY_MARKS[index])
+        return int(comment_id, 36) in self.done
 
-    return word
+    def is_pending(self, comment_id):
+        """Checks if the bot started replying to the comment but didn't confirm it."""
+
+        return int(comment_id, 36) in self.pending
+
+    def update(self, comment, status):
+        """Saves the status of the comment, it's on disk before the method returns.
+
+        Parameters
+        ----------
+        comment : praw.models.Comment
+            The processed comment.
+
+        status : int
+            PENDING before replying, DONE after replying.
+
+        """
+
+        comment_id = int(comment.id, 36)
+
+        # The link_id of a comment is the thread fullname, like t3_938fpu.
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO comments VALUES (?, ?, ?)",
+                                    (comment_id, comment.link_id.split("_")[-1], status))
+            self.connection.commit()
+
+        self.legacy.discard(comment_id)
+
+        if status == DONE:
+            self.pending.discard(comment_id)
+            self.done.add(comment_id)
+        else:
+            self.pending.add(comment_id)
 
 
 if __name__ == "__main__":
 
-    # We use multithreading to accelerate the reading of all files.
-    master_list = list()
+    parser = argparse.ArgumentParser(
+        description="Answers the !empleos comments of the monitored threads.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and answer the new comments as they arrive")
+    args = parser.parse_args()
+
+    # A previous run that is still replying would answer the same pending comments.
+    instance_lock = lock_instance()
+
+    if instance_lock is None:
+        print("Another instance is running.")
+        raise SystemExit
+
+    # Only the files that weren't parsed in previous runs are read from disk.
+    connection = listings_store.connect()
+
+    if args.daemon:
+        run_daemon(create_reddit(), connection)
+    else:
+        # The snapshot has the listings already created, only the newer log entries are read.
+        master_list = snapshot.load_window(connection, snapshot.get_cutoff())
+
+        if master_list is None:
+            master_list = list()
+
+            for listing in listings_store.load_listings(connection, load_files()):
+                parse_file(listing)
+
+            # We sort from highest to lowest salary, the index is built if there's a query.
+            master_list.sort(reverse=True, key=lambda listing: listing.salary)
+            master_list = snapshot.Window.from_listings(master_list)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for file in load_files():
-            executor.submit(parse_file, file)
+        # This bot runs every minute, it usually parses the new files before the others.
+        extractor.print_report()
 
-    # We sort from highest to lowest salary.
-    master_list.sort(reverse=True, key=lambda tup: tup[0])
+        reddit = create_reddit()
+        scheduler = ReplyScheduler(reddit, CommentsLog())
 
-    load_comments()
+        load_comments(reddit, scheduler)
+        scheduler.join()
+        scheduler.print_metrics()
@@ -16,5 +16,12 @@ JOBS_MAX_AGE = 86400 * 3
 # The threads that the post_bot will keep updating.
 POST_IDS = ["93i25l", "93i25l"]
 
+# The digests the post_bot creates and the threads where each one is posted. All the keys
+# except post_ids are optional: state, minimum_salary, maximum_salary, keyword and header.
+# For example: {"post_ids": ["abc123"], "state": "Jalisco", "minimum_salary": 15000}
+DIGESTS = [
+    {"post_ids": POST_IDS}
+]
+
 # The threads the comments_bot will keep checking for new comments.
 SUBMISSION_IDS = ["938fpu", "93i25l", "93au4i", "952ifq"]
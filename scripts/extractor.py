@@ -0,0 +1,276 @@
+"""
+This module extracts the values of interest from the job listings pages.
+
+The XPath expressions are compiled once and, except for the url, evaluated from the
+listing detail container instead of the document root. Each page also gets a layout
+fingerprint and the values that can't be extracted are counted, so changes in the
+empleo.gob.mx layout are visible instead of silently dropping listings.
+
+The values are all found before the end of the detail container, so a pull parser stops
+reading the page there and the rest of it (footer, scripts) is never parsed.
+"""
+
+import collections
+
+import lxml.etree
+import lxml.html
+
+# The container of the listing details, all the other values are found inside it.
+CONTAINER_XPATH = lxml.etree.XPath("/html/body/div[1]/div[8]")
+NAME_XPATH = lxml.etree.XPath("div[1]/div/h3/small")
+DETAILS_XPATH = lxml.etree.XPath("div[4]/div/div[2]/div")
+
+# The next ones are relative to the details block.
+SALARY_XPATH = lxml.etree.XPath("div[1]/div/div/span")
+LOCATION_XPATH = lxml.etree.XPath("div[2]/div/div/span")
+DAYS_XPATH = lxml.etree.XPath("div[5]/div/div/span")
+HOURS_XPATH = lxml.etree.XPath("div[6]/div/div/span")
+
+# The url is in the head, we only search the whole document if it isn't there.
+URL_XPATH = lxml.etree.XPath("/html/head/meta[@property='og:url']/@content")
+URL_FALLBACK_XPATH = lxml.etree.XPath("//meta[@property='og:url']/@content")
+
+# The fast path feeds the HTML to a pull parser in chunks of this many characters.
+# The pull parser is slower per character than a full parse, so smaller pages are
+# parsed in full right away.
+FEED_SIZE = 4096
+PARTIAL_MIN_SIZE = 32768
+
+# Increased when the extracted values change, the listings stored by older versions
+# are extracted again.
+EXTRACTOR_VERSION = 1
+
+# The values we extract, in the same order as they are returned.
+FIELDS = ["salary", "name", "location", "url",
+          "hours", "days", "state", "municipality", "layout"]
+
+# The number of pages processed, the pages where each value couldn't be extracted and
+# the pages seen with each layout fingerprint.
+stats = collections.Counter()
+failures = collections.Counter()
+layouts = collections.Counter()
+
+
+def get_text(xpath, element):
+    """Gets the text of the first element found by the XPath, or None."""
+
+    if element is None:
+        return None
+
+    found = xpath(element)
+
+    return found[0].text if found else None
+
+
+def get_layout(container, details):
+    """Gets a fingerprint of the page layout, the number of children of each
+    element in the path to the listing details.
+
+    Parameters
+    ----------
+    container : lxml.etree.Element
+        The listing detail container, or None.
+
+    details : lxml.etree.Element
+        The details block, or None.
+
+    Returns
+    -------
+    str
+        The fingerprint, for example '4:6'.
+
+    """
+
+    return ":".join(["-" if element is None else str(len(element))
+                     for element in [container, details]])
+
+
+def is_container(element):
+    """Checks if the element is the listing detail container (/html/body/div[1]/div[8])."""
+
+    parent = element.getparent()
+
+    if parent is None or parent.tag != "div":
+        return False
+
+    grandparent = parent.getparent()
+
+    if grandparent is None or grandparent.tag != "body" or grandparent.find("div") is not parent:
+        return False
+
+    # The events are read after each chunk, the parser may already be past the container.
+    divs = parent.findall("div")
+
+    return len(divs) >= 8 and divs[7] is element
+
+
+def parse_partial(html_text):
+    """Parses the HTML only until the end of the listing detail container.
+
+    Parameters
+    ----------
+    html_text : str
+        The HTML of the listing page.
+
+    Returns
+    -------
+    lxml.etree.Element
+        The root of the partial document, or None if the container wasn't found.
+
+    """
+
+    parser = lxml.etree.HTMLPullParser(events=("end",), tag="div")
+
+    for index in range(0, len(html_text), FEED_SIZE):
+
+        parser.feed(html_text[index:index + FEED_SIZE])
+
+        for event, element in parser.read_events():
+            if is_container(element):
+                return element.getroottree().getroot()
+
+    return None
+
+
+def extract_values(html):
+    """Extracts values of interest from a parsed page.
+
+    Parameters
+    ----------
+    html : lxml.etree.Element
+        The root of the page, it can be a partial document.
+
+    Returns
+    -------
+    tuple
+        The values in the same order as FIELDS.
+
+    """
+
+    salary = name = location = url = hours = days = state = municipality = None
+
+    # The container is resolved once, the other values are searched inside it.
+    containers = CONTAINER_XPATH(html)
+    container = containers[0] if containers else None
+
+    details = None
+
+    if container is not None:
+        found = DETAILS_XPATH(container)
+        details = found[0] if found else None
+
+    name = get_text(NAME_XPATH, container)
+    location = get_text(LOCATION_XPATH, details)
+    hours = get_text(HOURS_XPATH, details)
+    days = get_text(DAYS_XPATH, details)
+
+    salary = get_text(SALARY_XPATH, details)
+
+    try:
+        salary = int(float(salary.replace("$", "").replace(",", "")))
+    except (AttributeError, ValueError):
+        salary = None
+
+    try:
+        state, municipality = [x.strip() for x in location.split(",")]
+    except (AttributeError, ValueError):
+        state = municipality = None
+
+    urls = URL_XPATH(html) or URL_FALLBACK_XPATH(html)
+
+    if urls:
+        url = urls[0].replace("x//", "x/")
+
+    return (salary, name, location, url, hours, days, state, municipality,
+            get_layout(container, details))
+
+
+def extract_listing(html_text):
+    """Parses the HTML of a listing and extracts values of interest using lxml.
+
+    Each value is extracted on its own, a value that can't be found is returned as None.
+    This way the scripts can decide which values they require.
+
+    Parameters
+    ----------
+    html_text : str
+        The HTML of the listing page.
+
+    Returns
+    -------
+    tuple
+        The values in the same order as FIELDS.
+
+    """
+
+    html = None
+
+    # The fast path only parses the start of the page.
+    if len(html_text) >= PARTIAL_MIN_SIZE:
+        try:
+            html = parse_partial(html_text)
+        except (lxml.etree.ParserError, ValueError):
+            html = None
+
+    if html is not None:
+        values = extract_values(html)
+
+        if None not in values:
+            return values
+
+    # If any value is missing we parse the full page, very few times the HTML
+    # is corrupted and can't be fixed.
+    try:
+        html = lxml.html.fromstring(html_text)
+    except (lxml.etree.ParserError, ValueError):
+        return (None,) * (len(FIELDS) - 1) + ("unparseable",)
+
+    return extract_values(html)
+
+
+def count_results(values_list):
+    """Adds the extraction results to the counters.
+
+    Parameters
+    ----------
+    values_list : list
+        The tuples returned by extract_listing.
+
+    """
+
+    for values in values_list:
+        stats["pages"] += 1
+        layouts[values[-1]] += 1
+
+        for field, value in zip(FIELDS, values):
+            if value is None:
+                failures[field] += 1
+
+
+def print_report(reset=False):
+    """Prints the extraction counters, nothing is printed if no page was processed.
+
+    Parameters
+    ----------
+    reset : bool
+        Whether to clear the counters afterwards, long running processes print the
+        pages parsed since the previous report.
+
+    """
+
+    if not stats["pages"]:
+        return
+
+    print("Parsed pages:", stats["pages"])
+
+    for field in FIELDS[:-1]:
+        if failures[field]:
+            print("Missing or invalid {}: {}".format(field, failures[field]))
+
+    for layout, count in layouts.most_common():
+        print("Layout {}: {}".format(layout, count))
+
+    if reset:
+        stats.clear()
+        failures.clear()
+        layouts.clear()
@@ -0,0 +1,41 @@
+"""
+This module contains the file helpers shared by all the scripts.
+"""
+
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def replace_file(file_path, mode="w", sync=False):
+    """Opens a temporary file that replaces the specified file once it's written, so the
+    file is never left half written. If an error happens the file isn't replaced.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file to replace, the temporary file is next to it.
+
+    mode : str
+        'w' to write text (UTF-8) or 'wb' to write bytes.
+
+    sync : bool
+        Whether to flush the new file to disk before it replaces the old one.
+
+    Yields
+    ------
+    file
+        The temporary file.
+
+    """
+
+    temp_path = file_path + ".tmp"
+
+    with open(temp_path, mode, encoding=None if "b" in mode else "utf-8") as temp_file:
+        yield temp_file
+
+        if sync:
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+    os.replace(temp_path, file_path)
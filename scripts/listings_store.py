@@ -0,0 +1,266 @@
+"""
+This module keeps an incremental store of the values extracted from the job listings.
+
+Each .html file is parsed only once, its values are saved into a SQLite database keyed
+by the file path and its modification time. The bots and step2.py read from this store
+and only parse the files they haven't seen before (or that changed since). The values
+saved by an older extractor.EXTRACTOR_VERSION are also parsed again.
+
+The scraper can also save the values right after downloading a listing (scraper.py --extract),
+in that case the listing is never parsed again by the other scripts.
+"""
+
+import sqlite3
+import zlib
+from typing import NamedTuple
+
+import archive
+import extractor
+import text_utils
+
+# The file path where the store is saved.
+STORE_FILE = "listings.db"
+
+# The values we keep for each listing, in the same order as they are returned.
+FIELDS = extractor.FIELDS
+
+# SQLite has a limit on the number of variables per query, we stay well below it.
+QUERY_CHUNK_SIZE = 500
+
+
+class Listing(NamedTuple):
+    """The values the bots use from each listing, with the display and search fields
+    already computed so they aren't rebuilt on every run or query.
+    """
+
+    salary: int
+    offer: str
+    company: str
+    location: str
+    url: str
+    location_text: str
+    name_text: str
+    row: str
+
+
+def create_listing(salary, name, location, url):
+    """Creates a Listing with its display and search fields.
+
+    Parameters
+    ----------
+    salary : int
+        The monthly salary.
+
+    name : str
+        The listing name, the offer and the company separated by a dash.
+
+    location : str
+        The state and the municipality.
+
+    url : str
+        The listing url.
+
+    Returns
+    -------
+    Listing
+        The listing with its Markdown table row already rendered.
+
+    """
+
+    # We separate and clean the job name and the company name.
+    offer = name.split("-")[0].title().strip()
+    company = name.split("-")[-1].strip()
+
+    if "sin nombre" in company.lower():
+        company = "S/N"
+    else:
+        company = company.title()
+
+    row = "[{}]({}) | {} | ${:,} | {}\n".format(
+        offer, url, company, salary, location)
+
+    return Listing(salary, offer, company, location, url, text_utils.clean_location(location.lower()),
+                   text_utils.clean_word(name.lower()), row)
+
+
+def get_listing(values):
+    """Creates a Listing from the stored values of a listing.
+
+    Parameters
+    ----------
+    values : tuple
+        The listing values, in the same order as FIELDS.
+
+    Returns
+    -------
+    Listing
+        The listing, or None if any of the values the bots require is missing.
+
+    """
+
+    # Very few times the HTML is corrupted and some values are missing.
+    if values is None:
+        return None
+
+    salary, name, location, url = values[:4]
+
+    if None in (salary, name, location, url):
+        return None
+
+    return create_listing(salary, name, location, url)
+
+
+def connect(store_file=STORE_FILE, check_same_thread=True):
+    """Opens the store and creates the listings table if it doesn't exist.
+
+    Parameters
+    ----------
+    store_file : str
+        The path of the SQLite database.
+
+    check_same_thread : bool
+        False allows other threads to use the connection, they must not use it at the same time.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection to the store.
+
+    """
+
+    connection = sqlite3.connect(store_file, check_same_thread=check_same_thread)
+
+    connection.execute("""CREATE TABLE IF NOT EXISTS listings (
+        path TEXT PRIMARY KEY, mtime REAL NOT NULL, salary INTEGER, name TEXT, location TEXT,
+        url TEXT, hours TEXT, days TEXT, state TEXT, municipality TEXT, layout TEXT,
+        version INTEGER NOT NULL DEFAULT 0)""")
+
+    # Stores created before the layout fingerprint and the extractor version were added
+    # don't have their columns, their rows are parsed again.
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(listings)")]
+
+    if "layout" not in columns:
+        connection.execute("ALTER TABLE listings ADD COLUMN layout TEXT")
+
+    if "version" not in columns:
+        connection.execute("ALTER TABLE listings ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    return connection
+
+
+def extract_listing(file_name):
+    """Reads a listing (from its .html file or the archive) and extracts values of interest
+    with the extractor module.
+
+    Parameters
+    ----------
+    file_name : str
+        The name of the file to be parsed.
+
+    Returns
+    -------
+    tuple
+        The values in the same order as FIELDS.
+
+    """
+
+    try:
+        html_text = archive.read_listing(file_name)
+    except (OSError, UnicodeDecodeError, zlib.error):
+        return (None,) * (len(FIELDS) - 1) + ("unreadable",)
+
+    return extractor.extract_listing(html_text)
+
+
+def save_listing(connection, file_name, values):
+    """Saves the values of a listing that was just saved to disk or to the archive.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the store.
+
+    file_name : str
+        The listing path, the same one written to the log.
+
+    values : tuple
+        The values returned by extractor.extract_listing.
+
+    """
+
+    # The modification time is read the same way as load_listings does, so the row
+    # is found valid there and the listing isn't parsed again.
+    connection.execute("INSERT OR REPLACE INTO listings (path, mtime, version, {}) VALUES ({})".format(
+        ", ".join(FIELDS), ", ".join("?" * (len(FIELDS) + 3))),
+        (file_name, archive.get_mtime(file_name), extractor.EXTRACTOR_VERSION) + tuple(values))
+
+    connection.commit()
+
+
+def load_listings(connection, files_list, map_function=map):
+    """Returns the stored values for each file, parsing only the new or modified ones.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the store.
+
+    files_list : list
+        The paths of the listings files.
+
+    map_function : function
+        The function used to parse the new files, an executor map can be used here.
+
+    Returns
+    -------
+    list
+        One tuple of values (same order as FIELDS) for each file, in the same order
+        as files_list. Files that no longer exist get None instead of a tuple.
+
+    """
+
+    # We first get the current modification time of every file, archived listings
+    # keep the one they had when they were archived.
+    mtimes = dict()
+
+    for file_name in files_list:
+        try:
+            mtimes[file_name] = archive.get_mtime(file_name)
+        except OSError:
+            pass
+
+    # Then we read the values we already have, a few hundred paths at a time.
+    stored = dict()
+    paths = list(mtimes.keys())
+
+    for index in range(0, len(paths), QUERY_CHUNK_SIZE):
+        chunk = paths[index:index + QUERY_CHUNK_SIZE]
+
+        query = "SELECT path, mtime, version, {} FROM listings WHERE path IN ({})".format(
+            ", ".join(FIELDS), ", ".join("?" * len(chunk)))
+
+        for row in connection.execute(query, chunk):
+            if row[1] == mtimes[row[0]] and row[2] == extractor.EXTRACTOR_VERSION:
+                stored[row[0]] = row[3:]
+
+    # Only the files we haven't seen before (or that were modified or extracted by an
+    # older version) are parsed.
+    new_files = [x for x in paths if x not in stored]
+
+    if new_files:
+
+        new_rows = list()
+
+        for file_name, values in zip(new_files, map_function(extract_listing, new_files)):
+            stored[file_name] = values
+            new_rows.append((file_name, mtimes[file_name], extractor.EXTRACTOR_VERSION) + tuple(values))
+
+        # The counters are kept in this process, the parsing may happen in other ones.
+        extractor.count_results(stored[x] for x in new_files)
+
+        connection.executemany("INSERT OR REPLACE INTO listings (path, mtime, version, {}) VALUES ({})".format(
+            ", ".join(FIELDS), ", ".join("?" * (len(FIELDS) + 3))), new_rows)
+
+        connection.commit()
+
+    return [stored.get(file_name) for file_name in files_list]
@@ -0,0 +1,353 @@
+"""
+This module reads the log file created by the scraper.
+
+The log is append only and ordered by time, so the entries inside the JOBS_MAX_AGE
+window are found with a binary search instead of reading and parsing every line.
+Old entries are periodically moved to an archive file, the archive followed by the
+log is always the full history, byte for byte.
+
+The writers (the scraper and the compaction) hold an exclusive lock on LOCK_FILE and the
+readers a shared one while they open both files. The log itself can't be locked, the
+compaction replaces it with a new file.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+import file_utils
+
+LOG_FILE = "log.txt"
+ARCHIVE_FILE = "log_archive.txt"
+LOCK_FILE = "log.lock"
+
+# The compaction in progress, used to finish or undo it after a crash.
+COMPACT_FILE = "log_compact.json"
+
+# The log is only compacted when the old entries take at least this many bytes.
+COMPACT_MIN_BYTES = 1024 * 1024
+
+
+@contextmanager
+def lock_log(shared=False):
+    """Holds the lock of the log files until the block ends.
+
+    Parameters
+    ----------
+    shared : bool
+        Whether to take a shared (reader) lock instead of an exclusive (writer) one.
+
+    """
+
+    with open(LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+
+def parse_timestamp(line):
+    """Gets the timestamp of a log line, the date has a fixed ISO format.
+
+    Parameters
+    ----------
+    line : bytes
+        The log line, with the file name and the date separated by a comma.
+
+    Returns
+    -------
+    float
+        The POSIX timestamp of the date.
+
+    """
+
+    return datetime.fromisoformat(line.rstrip(b"\n").split(b",")[-1].decode("utf-8")).timestamp()
+
+
+def find_offset(temp_file, cutoff_timestamp):
+    """Finds the byte offset of the first entry not older than the cutoff timestamp.
+
+    Parameters
+    ----------
+    temp_file : file
+        The log file, opened in binary mode.
+
+    cutoff_timestamp : float
+        The POSIX timestamp where the window starts.
+
+    Returns
+    -------
+    int
+        The byte offset of the first entry inside the window.
+
+    """
+
+    # The offset is always between low and high and low is always the start of a line.
+    low = 0
+    high = temp_file.seek(0, os.SEEK_END)
+
+    while low < high:
+
+        # We move to the start of the first line after the middle point.
+        middle = (low + high) // 2
+        temp_file.seek(middle)
+
+        if middle > low:
+            temp_file.readline()
+
+        start = temp_file.tell()
+
+        # There isn't any line starting between middle and high, we check the line at low.
+        if start >= high:
+            start = low
+            temp_file.seek(start)
+
+        line = temp_file.readline()
+
+        # An incomplete last line is being written right now, it's inside the window.
+        try:
+            is_inside = not line.endswith(b"\n") or parse_timestamp(
+                line) >= cutoff_timestamp
+        except ValueError:
+            is_inside = True
+
+        if is_inside:
+            high = start
+        else:
+            low = start + len(line)
+
+    return low
+
+
+def load_window(cutoff_timestamp):
+    """Reads the file names of the log entries that are not older than the cutoff timestamp.
+
+    Parameters
+    ----------
+    cutoff_timestamp : float
+        The POSIX timestamp where the window starts.
+
+    Returns
+    -------
+    list
+        The file names, in the same order as the log.
+
+    """
+
+    with open(LOG_FILE, "rb") as temp_file:
+
+        temp_file.seek(find_offset(temp_file, cutoff_timestamp))
+        files_list = list()
+
+        # All the remaining entries are inside the window, their dates aren't parsed.
+        for line in temp_file:
+            if line.endswith(b"\n"):
+                files_list.append(line.split(b",")[0].decode("utf-8"))
+
+        return files_list
+
+
+def find_window_offset(cutoff_timestamp):
+    """Finds the offset of the first entry not older than the cutoff timestamp in the full
+    history (archive and log), the same offsets used by iter_log.
+
+    Parameters
+    ----------
+    cutoff_timestamp : float
+        The POSIX timestamp where the window starts.
+
+    Returns
+    -------
+    int
+        The byte offset of the first entry inside the window.
+
+    """
+
+    with lock_log(shared=True):
+
+        try:
+            archive_size = os.path.getsize(ARCHIVE_FILE)
+        except OSError:
+            archive_size = 0
+
+        try:
+            with open(LOG_FILE, "rb") as temp_file:
+                return archive_size + find_offset(temp_file, cutoff_timestamp)
+        except FileNotFoundError:
+            return archive_size
+
+
+def open_history():
+    """Opens the archive and the log at the same point of the history.
+
+    Only the sizes seen here must be read. A later compaction appends to the archive and
+    the log keeps pointing to the replaced file, which has the same entries.
+
+    Returns
+    -------
+    list
+        The (file, size) of each file, the archive first. The file is None if it doesn't exist.
+
+    """
+
+    files = list()
+
+    with lock_log(shared=True):
+        for file_path in [ARCHIVE_FILE, LOG_FILE]:
+            try:
+                temp_file = open(file_path, "rb")
+                files.append((temp_file, temp_file.seek(0, os.SEEK_END)))
+            except FileNotFoundError:
+                files.append((None, 0))
+
+    return files
+
+
+def iter_log(offset=0):
+    """Reads the full history (archive and log) starting at the specified byte offset.
+
+    Parameters
+    ----------
+    offset : int
+        The byte offset where the reading starts.
+
+    Yields
+    ------
+    tuple
+        The (file_name, file_date, end_offset) of each entry, end_offset is the byte
+        offset right after the entry line.
+
+    """
+
+    position = 0
+    files = open_history()
+
+    try:
+        for temp_file, size in files:
+
+            if temp_file is None:
+                continue
+
+            if offset >= position + size:
+                position += size
+                continue
+
+            temp_file.seek(max(offset - position, 0))
+            end = position + size
+            position += temp_file.tell()
+
+            while position < end:
+
+                line = temp_file.readline(end - position)
+
+                # Only a crashed write leaves an incomplete last line, we stop there.
+                if not line.endswith(b"\n"):
+                    return
+
+                position += len(line)
+                file_name, file_date = line.decode("utf-8").rstrip("\n").split(",")
+                yield (file_name, file_date, position)
+    finally:
+        for temp_file, _ in files:
+            if temp_file is not None:
+                temp_file.close()
+
+
+def replace_log(entries):
+    """Replaces the log with the specified entries, they are on disk before the old log is replaced."""
+
+    with file_utils.replace_file(LOG_FILE, "wb", sync=True) as log_file:
+        log_file.write(entries)
+
+
+def recover_compaction():
+    """Finishes or undoes a compaction interrupted by a crash, using the COMPACT_FILE record.
+    This must be called holding the exclusive lock.
+
+    """
+
+    try:
+        with open(COMPACT_FILE, "r", encoding="utf-8") as temp_file:
+            record = json.load(temp_file)
+    except FileNotFoundError:
+        return
+
+    archive_size = record["archive_size"]
+    moved_size = record["moved_size"]
+
+    with open(ARCHIVE_FILE, "ab") as archive_file:
+
+        # The archive append didn't finish, the log still has all the entries.
+        if archive_file.seek(0, os.SEEK_END) < archive_size + moved_size:
+            archive_file.truncate(archive_size)
+            os.fsync(archive_file.fileno())
+            moved_size = 0
+
+    if moved_size:
+
+        with open(ARCHIVE_FILE, "rb") as archive_file:
+            archive_file.seek(archive_size)
+            moved_entries = archive_file.read(moved_size)
+
+        try:
+            with open(LOG_FILE, "rb") as log_file:
+                log_head = log_file.read(moved_size)
+                new_entries = log_file.read()
+        except FileNotFoundError:
+            log_head = None
+
+        # The log wasn't replaced, its head is already at the end of the archive.
+        if log_head == moved_entries:
+            replace_log(new_entries)
+
+    os.remove(COMPACT_FILE)
+
+
+def compact_log(cutoff_timestamp):
+    """Moves the entries older than the cutoff timestamp from the log to the archive.
+    This must only be called by the log writer (the scraper).
+
+    Parameters
+    ----------
+    cutoff_timestamp : float
+        The POSIX timestamp where the window starts.
+
+    """
+
+    with lock_log():
+
+        recover_compaction()
+
+        try:
+            temp_file = open(LOG_FILE, "rb")
+        except FileNotFoundError:
+            return
+
+        with temp_file:
+            offset = find_offset(temp_file, cutoff_timestamp)
+
+            if offset < COMPACT_MIN_BYTES:
+                return
+
+            temp_file.seek(0)
+            old_entries = temp_file.read(offset)
+            new_entries = temp_file.read()
+
+        try:
+            archive_size = os.path.getsize(ARCHIVE_FILE)
+        except OSError:
+            archive_size = 0
+
+        # The move is recorded first, a crash at any point after it is recovered on the
+        # next call instead of leaving the entries in both files.
+        with file_utils.replace_file(COMPACT_FILE, sync=True) as temp_file:
+            json.dump({"archive_size": archive_size, "moved_size": offset}, temp_file)
+
+        # The archive is appended first, the concatenation of both files stays the same.
+        with open(ARCHIVE_FILE, "ab") as archive_file:
+            archive_file.write(old_entries)
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+        replace_log(new_entries)
+        os.remove(COMPACT_FILE)
@@ -2,122 +2,292 @@
 This bot analyzes job listings that are no older than the JOBS_MAX_AGE and creates
 a digest of the highest paying ones.
 
-The digest is formatted with Markdown and posted to Reddit.
+The digest is formatted with Markdown and posted to Reddit. More digests (by state, salary
+band or keyword) can be defined in config.DIGESTS, they are all built from the same listings.
+A hash of the table of each post is kept, the posts are only edited when their table changed.
 """
 
-import concurrent.futures
+import hashlib
+import json
 from datetime import datetime, timedelta
 
-import lxml.html
+import numpy as np
 import praw
 
 import config
+import extractor
+import file_utils
+import listings_store
+import log_reader
+import snapshot
+import text_utils
 
 MIN_SALARY_THRESHOLD = 8000
 
+# The hash of the table last posted to each thread.
+POST_HASHES_FILE = "post_hashes.json"
+
+# Reddit has a 40,000 characters limit on posts, the rest is left for the footer.
+MAX_DIGEST_LENGTH = 39000
+
+# The states as they are written in the listings locations.
+STATES = ["Aguascalientes", "Baja California", "Baja California Sur", "Campeche", "Chiapas",
+          "Chihuahua", "Ciudad de México", "Coahuila", "Colima", "Durango", "Guanajuato",
+          "Guerrero", "Hidalgo", "Jalisco", "México", "Michoacán", "Morelos", "Nayarit",
+          "Nuevo León", "Oaxaca", "Puebla", "Querétaro", "Quintana Roo", "San Luis Potosí",
+          "Sinaloa", "Sonora", "Tabasco", "Tamaulipas", "Tlaxcala", "Veracruz", "Yucatán",
+          "Zacatecas"]
+
+DIGEST_HEADER = ("Las ofertas aqui presentes no son mayores a 3 días.\n\n"
+                 "Se actualiza cada 15 minutos. Ordenado por Salario Neto Mensual (MXN).\n\n"
+                 "Oferta | Empresa | Salario Neto Mensual | Ubicación\n--|--|--|--\n")
+
 
 def load_files():
-    """Reads the log file and discards the files that are older than the JOB_MAX_AGE."""
+    """Reads the log file entries that are no older than the JOBS_MAX_AGE."""
 
     now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
-    now_timestamp = now.timestamp()
 
-    with open("log.txt", "r", encoding="utf-8") as temp_file:
+    # The log is ordered by time, the start of the window is found with a binary search.
+    return log_reader.load_window(now.timestamp() - config.JOBS_MAX_AGE)
+
 
-        files_list = list()
+def parse_file(listing):
+    """Takes the values of interest from a stored listing and adds them to the master_list.
 
-        for item in temp_file.read().splitlines():
+    Parameters
+    ----------
+    listing : tuple
+        The listing values, in the same order as listings_store.FIELDS.
 
-            file_name, file_date = item.split(",")
+    """
 
-            file_timestamp = datetime.strptime(
-                file_date, "%Y-%m-%d %H:%M:%S.%f").timestamp()
+    # The offer, company and table row are computed once here instead of on every pass.
+    listing = listings_store.get_listing(listing)
 
-            if (now_timestamp - file_timestamp) <= config.JOBS_MAX_AGE:
-                files_list.append(file_name)
+    if listing is not None:
+        master_list.append(listing)
 
-        return files_list
 
+def build_digest(listings, header=DIGEST_HEADER, min_salary=MIN_SALARY_THRESHOLD,
+                 max_length=MAX_DIGEST_LENGTH):
+    """Creates the Markdown table with the highest paying listings that fit in the digest.
 
-def parse_file(file_name):
-    """Parses a .html file and extracts values of interest using lxml.
+    The listings are already sorted by salary, they are read in order until the digest is
+    full. With a snapshot.Window only the listings that fit in the digest are decoded.
 
     Parameters
     ----------
-    file_name : str
-        The name of the file to be parsed.
+    listings : iterable
+        The Listing tuples to choose from, sorted from highest to lowest salary.
+
+    header : str
+        The text before the table rows.
+
+    min_salary : int
+        The listings with a lower salary are discarded.
+
+    max_length : int
+        Rows are added while the digest is at most this many characters long.
+
+    Returns
+    -------
+    str
+        The header followed by the rows, from highest to lowest salary.
 
     """
 
-    with open(file_name, "r", encoding="utf-8") as temp_file:
+    rows = [header]
+    length = len(header)
 
-        # Very few times the HTML is corrupted and can't be fixed.
-        try:
-            html = lxml.html.fromstring(temp_file.read())
+    # We avoid hitting the Reddit 40,000 characters limit.
+    for listing in listings:
 
-            salary = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[1]/div/div/span")[0].text
+        if length > max_length or listing.salary < min_salary:
+            break
 
-            clean_salary = int(float(salary.replace("$", "").replace(",", "")))
+        rows.append(listing.row)
+        length += len(listing.row)
 
-            name = html.xpath(
-                "/html/body/div[1]/div[8]/div[1]/div/h3/small")[0].text
+    return "".join(rows)
 
-            location = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[2]/div/div/span")[0].text
 
-            url = html.xpath(
-                "//meta[@property='og:url']/@content")[0].replace("x//", "x/")
+def get_state(location_text):
+    """Gets the normalised state of a listing, its location is 'State, Municipality'."""
 
-            master_list.append((clean_salary, name, location, url))
+    return location_text.split(",")[0].strip()
 
-        except:
-            pass
 
+def normalise_state(state):
+    """Normalises the state of a digest definition the same way as the listings locations."""
 
-def prepare_post():
-    """Filters jobs listings from the master_list and prepares a Markdown message."""
+    return text_utils.clean_word(state.lower().strip())
+
+
+def select_listings(partitions, digest):
+    """Gets the listings that satisfy the filters of a digest definition.
+
+    Parameters
+    ----------
+    partitions : dict
+        The ids of the listings of each normalised state, None has all the ids.
+
+    digest : dict
+        The digest definition, see config.DIGESTS.
+
+    Returns
+    -------
+    snapshot.Window
+        The listings, in the same order as the master_list.
+
+    """
+
+    if digest.get("state"):
+        listings_ids = partitions.get(normalise_state(digest["state"]), np.empty(0, dtype=np.int64))
+    else:
+        listings_ids = partitions[None]
+
+    maximum_salary = digest.get("maximum_salary")
+    keyword = text_utils.clean_word(digest.get("keyword", "").lower().strip())
+
+    # The salaries are filtered on the NumPy array, only the names are decoded.
+    if maximum_salary is not None:
+        listings_ids = listings_ids[master_list.salaries[listings_ids] <= maximum_salary]
+
+    if keyword:
+        name_texts = master_list.get_column("name_text")
+        listings_ids = listings_ids[np.fromiter(
+            (keyword in name_texts[x] for x in listings_ids.tolist()), dtype=bool, count=len(listings_ids))]
+
+    return master_list.select(listings_ids)
+
+
+def check_digests(digests):
+    """Checks that every digest has its own posts, two digests editing the same post
+    would overwrite each other on every run. A misspelled state would publish an empty
+    digest, so the states and keywords are also checked.
+
+    Parameters
+    ----------
+    digests : list
+        The digest definitions, see config.DIGESTS.
+
+    Raises
+    ------
+    ValueError
+        If a digest has no post_ids, shares a post with another digest, has an unknown
+        state or a keyword that isn't a string.
+
+    """
+
+    known_states = {normalise_state(state) for state in STATES}
+    digest_by_post = dict()
+
+    for index, digest in enumerate(digests):
+
+        if not digest.get("post_ids"):
+            raise ValueError("Digest {} has no post_ids.".format(index))
+
+        state = digest.get("state")
+
+        if state is not None and (not isinstance(state, str) or normalise_state(state) not in known_states):
+            raise ValueError("Digest {} has an unknown state: {!r}.".format(index, state))
 
-    message = "Las ofertas aqui presentes no son mayores a 3 días.\n\n"
-    message += "Se actualiza cada 15 minutos. Ordenado por Salario Neto Mensual (MXN).\n\n"
-    message += "Oferta | Empresa | Salario Neto Mensual | Ubicación\n--|--|--|--\n"
+        if not isinstance(digest.get("keyword", ""), str):
+            raise ValueError("Digest {} keyword must be a string: {!r}.".format(
+                index, digest["keyword"]))
 
-    # We sort from highest to lowest salary.
-    master_list.sort(reverse=True, key=lambda tup: tup[0])
+        for post_id in set(digest["post_ids"]):
 
-    for salary, name, location, url in master_list:
+            if post_id in digest_by_post:
+                raise ValueError("Post {} is shared by digests {} and {}.".format(
+                    post_id, digest_by_post[post_id], index))
 
-        # We discard jobs that don't meet the minimum salary threshold.
-        if salary >= MIN_SALARY_THRESHOLD:
+            digest_by_post[post_id] = index
 
-            # We avoid hitting the Reddit 40,000 characters limit.
-            if len(message) <= 39000:
 
-                # We then separate and clean the job name and the company name.
-                offer = name.split("-")[0].title().strip()
-                company = name.split("-")[-1].strip()
+def prepare_post():
+    """Filters jobs listings from the master_list and prepares a Markdown message for
+    each digest defined in config.DIGESTS.
+    """
+
+    # The listings ids are split by state once, every digest reads from these arrays.
+    partitions = {None: np.arange(len(master_list))}
+
+    # The default digest has no state, the locations are only decoded for the others.
+    if any(digest.get("state") for digest in config.DIGESTS):
+
+        states = dict()
 
-                if "sin nombre" in company.lower():
-                    company = "S/N"
-                else:
-                    company = company.title()
+        for listing_id, location_text in enumerate(master_list.get_column("location_text")):
+            states.setdefault(get_state(location_text), []).append(listing_id)
 
-                message += "[{}]({}) | {} | ${:,} | {}\n".format(
-                    offer, url, company, salary, location)
+        partitions.update({state: np.array(ids, dtype=np.int64) for state, ids in states.items()})
 
     # We finalize the mssage with the footer.
     now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
 
-    message += """\n*****\n^Última ^actualización: ^{:%d-%m-%Y ^a ^las ^%H:%M:%S} ^|
+    footer = """\n*****\n^Última ^actualización: ^{:%d-%m-%Y ^a ^las ^%H:%M:%S} ^|
         ^[Ayuda](https://redd.it/93au4i) ^|
         ^[Contacto](https://www.reddit.com/message/compose/?to=agent_phantom) ^|
         ^[GitHub](https://git.io/fNoyw)""".format(now)
 
-    update_post(message)
+    reddit = None
+
+    for digest in config.DIGESTS:
+
+        table = build_digest(select_listings(partitions, digest), digest.get("header", DIGEST_HEADER),
+                             digest.get("minimum_salary", MIN_SALARY_THRESHOLD))
+
+        # All the digests share the same Reddit client.
+        reddit = update_post(table + footer, table,
+                             reddit, digest["post_ids"])
+
+
+def load_post_hashes():
+    """Loads the post hashes. If the file doesn't exist or is damaged it returns an empty dict.
+
+    Returns
+    -------
+    dict
+        The hash of the last posted table, by post id.
+
+    """
+
+    try:
+        with open(POST_HASHES_FILE, "r", encoding="utf-8") as temp_file:
+            return json.load(temp_file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_post_hashes(post_hashes):
+    """Saves the post hashes.
+
+    Parameters
+    ----------
+    post_hashes : dict
+        The hash of the last posted table, by post id.
+
+    """
+
+    with file_utils.replace_file(POST_HASHES_FILE) as temp_file:
+        json.dump(post_hashes, temp_file, indent=4, sort_keys=True)
+
+
+def create_reddit():
+    """Creates the Reddit client with the credentials from the config module."""
+
+    return praw.Reddit(client_id=config.APP_ID, client_secret=config.APP_SECRET,
+                       user_agent=config.USER_AGENT, username=config.REDDIT_USERNAME,
+                       password=config.REDDIT_PASSWORD)
 
 
-def update_post(message):
-    """Updates the Reddit post with the specified Markdown message.
+def update_post(message, table=None, reddit=None, post_ids=None):
+    """Updates the Reddit posts with the specified Markdown message.
+
+    Posts whose table didn't change since their last edit are skipped, only the footer
+    timestamp would change.
 
     Parameters
     ----------
@@ -125,25 +295,67 @@ def update_post(message):
     message : str
         The Markdown formatted message.
 
+    table : str
+        The part of the message that is compared, the whole message by default.
+
+    reddit : praw.Reddit
+        The Reddit client, it's only created if a post needs to be edited.
+
+    post_ids : list
+        The posts to update, config.POST_IDS by default.
+
+    Returns
+    -------
+    praw.Reddit
+        The Reddit client, or None if it wasn't needed. It can be used for the next posts.
+
     """
 
-    # We initialize Reddit.
-    reddit = praw.Reddit(client_id=config.APP_ID, client_secret=config.APP_SECRET,
-                         user_agent=config.USER_AGENT, username=config.REDDIT_USERNAME,
-                         password=config.REDDIT_PASSWORD)
+    post_hashes = load_post_hashes()
+    table_hash = hashlib.sha1(
+        (message if table is None else table).encode("utf-8")).hexdigest()
+
+    # We update the Reddit theads, all of them share one client.
+    for post_id in config.POST_IDS if post_ids is None else post_ids:
+
+        if post_hashes.get(post_id) == table_hash:
+            print("Unchanged:", post_id)
+            continue
+
+        if reddit is None:
+            reddit = create_reddit()
 
-    # We update the Reddit theads.
-    for post_id in config.POST_IDS:
         reddit.submission(post_id).edit(message)
 
+        # The hash is saved after each edit, a failed edit is retried on the next run.
+        post_hashes[post_id] = table_hash
+        save_post_hashes(post_hashes)
+
+    return reddit
+
 
 if __name__ == "__main__":
 
-    # We use multithreading to accelerate the reading of all files.
-    master_list = list()
+    # A wrong digest definition is rejected before reading any listing.
+    check_digests(config.DIGESTS)
+
+    # Only the files that weren't parsed in previous runs are read from disk.
+    connection = listings_store.connect()
+
+    # The snapshot has the listings already created, only the newer log entries are read.
+    master_list = snapshot.load_window(connection, snapshot.get_cutoff())
+
+    if master_list is None:
+        master_list = list()
+
+        for listing in listings_store.load_listings(connection, load_files()):
+            parse_file(listing)
+
+        # The sort is stable, listings with the same salary keep the log order.
+        master_list.sort(reverse=True, key=lambda listing: listing.salary)
+        master_list = snapshot.Window.from_listings(master_list)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for file in load_files():
-            executor.submit(parse_file, file)
+    # The missing values and layout fingerprints of the newly parsed files.
+    extractor.print_report()
 
     prepare_post()
@@ -1,14 +1,34 @@
 """
 This script connects to https://empleos.gob.mx and checks each state in Mexico for new listings.
 The job listings are downloaded into their respective state folder.
+
+The state pages are requested with the ETag and Last-Modified values of the previous run,
+the listings links are only read again when the page changed.
+
+With --extract the values of interest are also extracted right after each download and saved
+into the listings store, so the other scripts never parse the listing again.
 """
 
+import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
+import threading
 import time
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
+import lxml.etree
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+
+import archive
+import config
+import extractor
+import file_utils
+import listings_store
+import log_reader
 
 STATES_URLS = [
     "1-busqueda-de-ofertas-de-empleo-en-aguascalientes",
@@ -50,8 +70,66 @@ HEADERS = {
 
 BASE_URL = "https://www.empleo.gob.mx"
 ROOT_FOLDER = "./states/"
+
+# The ETag, Last-Modified and content hash of each state page from the previous runs.
+STATE_CACHE_FILE = "state_cache.json"
+
+# Only the anchor tags of the results table that contain 'detalleoferta' in the url are job listings.
+LINKS_XPATH = lxml.etree.XPath(
+    "(//table)[1]//a[contains(@href, 'detalleoferta')]/@href")
 DELTA_HOURS = 0  # 0 for local time, 5 for Mexico Central Time.
 
+# The global request rate is shared by all workers, 2 per second is the same
+# pace as the original sequential mode (half a second between requests).
+REQUESTS_PER_SECOND = 2
+MAX_CONNECTIONS_PER_HOST = 4
+
+# Failed requests and 429/5xx responses are retried with an exponential backoff.
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# When enabled the listings are saved into the compressed archive instead of .html files.
+ARCHIVE_MODE = False
+
+# When enabled the listings are parsed while they are still in memory and their values
+# are saved into the listings store.
+EXTRACT_MODE = False
+
+# The state shared by the workers of a run, init() creates the session, the rate
+# limiter, the state pages cache and the store connection.
+main_session = None
+rate_limiter = None
+hosts_semaphores = dict()
+hosts_lock = threading.Lock()
+log_lock = threading.Lock()
+state_cache = dict()
+state_cache_lock = threading.Lock()
+store_connection = None
+store_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Spaces out the requests so they never exceed the specified rate, no matter
+    how many threads are making them.
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.next_request = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next request is allowed."""
+
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
 
 def create_folders():
     """Creates folders that will contain the listings html files.
@@ -63,6 +141,146 @@ def create_folders():
         os.makedirs(folder_path, exist_ok=True)
 
 
+def load_seen_ids(state_folder):
+    """Reads the state folder once and returns the ids of the listings already saved.
+
+    Parameters
+    ----------
+    state_folder : str
+        The folder where the state listings are saved.
+
+    Returns
+    -------
+    set
+        The listings ids, checking if a listing was already saved is then O(1).
+
+    """
+
+    seen_ids = set()
+
+    with os.scandir(state_folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".html"):
+                seen_ids.add(entry.name[:-5])
+
+    # The listings moved to the archive are also saved.
+    seen_ids.update(archive.load_listing_ids(
+        state_folder.rstrip("/").split("/")[-1]))
+
+    return seen_ids
+
+
+def load_state_cache():
+    """Loads the state pages cache. If it doesn't exist or is damaged it returns an empty dict.
+
+    Returns
+    -------
+    dict
+        The ETag, Last-Modified and content hash of each state page, by state url.
+
+    """
+
+    try:
+        with open(STATE_CACHE_FILE, "r", encoding="utf-8") as temp_file:
+            return json.load(temp_file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_state_cache():
+    """Saves the state pages cache, the workers save it after each state."""
+
+    with state_cache_lock, file_utils.replace_file(STATE_CACHE_FILE) as temp_file:
+        json.dump(state_cache, temp_file, indent=4, sort_keys=True)
+
+
+def create_session(workers=1):
+    """Creates the requests Session used by all the workers.
+
+    Parameters
+    ----------
+    workers : int
+        The number of states downloaded at the same time.
+
+    Returns
+    -------
+    requests.Session
+        The session with a connection pool big enough for all workers.
+
+    """
+
+    # The retries are done by fetch(), so each attempt goes through the rate limiter.
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=max(workers, MAX_CONNECTIONS_PER_HOST))
+
+    # Using a session greatly reduces timeouts and other errors.
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def fetch(url, headers=None):
+    """Requests the url once the rate limiter and the host connections cap allow it.
+
+    Failed requests and 429/5xx responses are retried up to MAX_RETRIES times, every
+    attempt waits for the rate limiter again.
+
+    Parameters
+    ----------
+    url : str
+        The url to request.
+
+    headers : dict
+        Extra headers for this request, like the conditional request ones.
+
+    Returns
+    -------
+    requests.Response
+        The server response.
+
+    Raises
+    ------
+    requests.RequestException
+        If the last attempt failed or was answered with a 429/5xx status.
+
+    """
+
+    host = urlsplit(url).netloc
+
+    with hosts_lock:
+        if host not in hosts_semaphores:
+            hosts_semaphores[host] = threading.BoundedSemaphore(
+                MAX_CONNECTIONS_PER_HOST)
+
+    for attempt in range(MAX_RETRIES + 1):
+
+        with hosts_semaphores[host]:
+            rate_limiter.wait()
+
+            try:
+                response = main_session.get(url, headers=headers, timeout=5)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAX_RETRIES:
+                    raise
+                response = None
+
+        if response is not None:
+
+            if response.status_code not in RETRY_STATUSES:
+                return response
+
+            if attempt == MAX_RETRIES:
+                response.raise_for_status()
+
+            response.close()
+
+        # The backoff happens outside the semaphore, other requests to the host can go on.
+        time.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+
 def download_state(state_url):
     """Checks for new listings on the specified url and downloads any new ones.
 
@@ -78,29 +296,90 @@ def download_state(state_url):
     state_folder = ROOT_FOLDER + state_url.split("-")[0] + "/"
     print("Downloading:", state_listings_url)
 
-    with main_session.get(state_listings_url, timeout=5) as response:
+    # The page is only sent again if it changed since the previous run.
+    cached = state_cache.get(state_url, dict())
+    headers = dict()
+
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with fetch(state_listings_url, headers) as response:
 
-        soup = BeautifulSoup(response.text, "html.parser")
+        if response.status_code == 304:
+            print("Unchanged:", state_listings_url)
+            return
 
-        # Only the anchor tags that contain 'detallesoferta' in the url are job listings.
-        for link in soup.find("table").find_all("a"):
-            if "detalleoferta" in link["href"]:
+        # Some servers don't support conditional requests, we also compare the content.
+        content_hash = hashlib.sha1(response.content).hexdigest()
 
-                listing_id = link["href"].split("=")[-1]
-                file_name = listing_id + ".html"
+        if content_hash == cached.get("hash"):
+            print("Unchanged:", state_listings_url)
+            return
 
-                # If the job listing is not already saved we save it.
-                if file_name not in os.listdir(state_folder):
+        links = LINKS_XPATH(lxml.html.fromstring(response.text))
 
-                    listing_url = BASE_URL + link["href"]
+        # The folder is only read once, new listings are added to the set as they are saved.
+        seen_ids = load_seen_ids(state_folder)
 
-                    with main_session.get(listing_url, timeout=5) as listing_response:
+        for link in links:
 
+            listing_id = link.split("=")[-1]
+            file_name = listing_id + ".html"
+
+            # If the job listing is not already saved we save it.
+            if listing_id not in seen_ids:
+
+                listing_url = BASE_URL + link
+
+                with fetch(listing_url) as listing_response:
+
+                    if ARCHIVE_MODE:
+                        archive.save_listing(
+                            state_folder + file_name, listing_response.text)
+                    else:
                         with open(state_folder + file_name, "w", encoding="utf-8") as temp_file:
                             temp_file.write(listing_response.text)
-                            print("Successfully Saved:", file_name)
-                            update_log(state_folder + file_name)
-                            time.sleep(0.5)
+
+                    if EXTRACT_MODE:
+                        save_values(state_folder + file_name,
+                                    listing_response.text)
+
+                    print("Successfully Saved:", file_name)
+                    update_log(state_folder + file_name)
+                    seen_ids.add(listing_id)
+
+        # The page is only marked as processed once all its listings were saved,
+        # if a download fails the page is read again on the next run.
+        with state_cache_lock:
+            state_cache[state_url] = {"etag": response.headers.get("ETag"),
+                                      "last_modified": response.headers.get("Last-Modified"),
+                                      "hash": content_hash}
+
+        save_state_cache()
+
+
+def save_values(file_name, html_text):
+    """Extracts the values of interest from a listing and saves them into the listings store.
+
+    Parameters
+    ----------
+    file_name : str
+        The listing path, the same one written to the log.
+
+    html_text : str
+        The HTML of the listing.
+
+    """
+
+    # The parsing happens in parallel, only the store and the counters are shared.
+    values = extractor.extract_listing(html_text)
+
+    with store_lock:
+        listings_store.save_listing(store_connection, file_name, values)
+        extractor.count_results([values])
 
 
 def update_log(file_name):
@@ -113,21 +392,87 @@ def update_log(file_name):
 
     """
 
-    with open("log.txt", "a", encoding="utf-8") as temp_file:
+    # The workers share the log file, only one of them can write at a time. The file
+    # lock keeps the compaction of another process from dropping the entry.
+    with log_lock, log_reader.lock_log(), \
+            open(log_reader.LOG_FILE, "a", encoding="utf-8") as temp_file:
         now = datetime.now() - timedelta(hours=DELTA_HOURS)
         temp_file.write("{},{}\n".format(file_name, now))
 
 
-if __name__ == "__main__":
+def init(workers=1, rate=REQUESTS_PER_SECOND, base_url=BASE_URL, archive_mode=False,
+         extract_mode=False):
+    """Creates the state shared by the workers, it must be called before downloading.
+
+    Parameters
+    ----------
+    workers : int
+        The number of states downloaded at the same time.
+
+    rate : float
+        The maximum number of requests per second, shared by all workers.
+
+    base_url : str
+        The site to scrape.
+
+    archive_mode : bool
+        Whether to save the listings into the compressed archive instead of .html files.
+
+    extract_mode : bool
+        Whether to extract the values of each new listing into the listings store.
+
+    """
+
+    global BASE_URL, ARCHIVE_MODE, EXTRACT_MODE, main_session, rate_limiter, \
+        hosts_semaphores, state_cache, store_connection
+
+    BASE_URL = base_url.rstrip("/")
+    ARCHIVE_MODE = archive_mode
+    EXTRACT_MODE = extract_mode
+
+    main_session = create_session(workers)
+    rate_limiter = RateLimiter(rate)
+    hosts_semaphores = dict()
+    state_cache = load_state_cache()
+
+    if EXTRACT_MODE:
+        store_connection = listings_store.connect(check_same_thread=False)
+
+
+def main():
+    """Downloads the new job listings of every state."""
+
+    parser = argparse.ArgumentParser(
+        description="Downloads the new job listings of every state.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of states downloaded at the same time")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="maximum number of requests per second, shared by all workers")
+    parser.add_argument("--base-url", default=BASE_URL,
+                        help="the site to scrape, useful to test against a local server")
+    parser.add_argument("--archive", action="store_true",
+                        help="save the listings into the compressed archive instead of .html files")
+    parser.add_argument("--extract", action="store_true",
+                        help="extract the values of each new listing into the listings store")
+    args = parser.parse_args()
 
     create_folders()
 
-    # Using a session greatly reduces timeouts and other errors.
-    main_session = requests.Session()
-    main_session.headers.update(HEADERS)
-    main_session.mount(
-        "https://", requests.adapters.HTTPAdapter(max_retries=3))
+    # The entries older than the bots window are moved to the archive, this keeps the log small.
+    now = datetime.now() - timedelta(hours=DELTA_HOURS)
+    log_reader.compact_log(now.timestamp() - config.JOBS_MAX_AGE)
 
-    for state in STATES_URLS:
-        download_state(state)
-        time.sleep(0.5)
+    init(args.workers, args.rate, args.base_url, args.archive, args.extract)
+
+    # The requests are spaced by the rate limiter, the workers only allow the
+    # states to be downloaded in parallel.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for future in [executor.submit(download_state, state) for state in STATES_URLS]:
+            future.result()
+
+    extractor.print_report()
+
+
+if __name__ == "__main__":
+
+    main()
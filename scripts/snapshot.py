@@ -0,0 +1,432 @@
+"""
+This module saves the listings of the JOBS_MAX_AGE window as a columnar snapshot.
+
+The salaries, states and log timestamps are saved as fixed width NumPy arrays and the text
+fields (already rendered rows, search texts, etc.) as UTF-8 string tables with the byte
+offset of each string, all of them sorted from highest to lowest salary. The bots load the
+arrays with np.load(mmap_mode="r"), only read the log entries added after the snapshot and
+don't query the listings store for the rest. A listing is only decoded when it's used,
+for example when its row is added to a digest or a reply.
+
+The snapshot is refreshed after each scraper run with:
+
+python3 snapshot.py
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import config
+import extractor
+import file_utils
+import listings_store
+import log_reader
+
+SNAPSHOT_FOLDER = "./snapshot/"
+
+# The text fields of each listing, saved as string tables.
+STRING_COLUMNS = ["offer", "company", "location", "url", "location_text", "name_text", "row"]
+
+# The strings of a table are separated by this character, it's never found in a listing.
+SEPARATOR = "\x00"
+
+
+def get_cutoff():
+    """Gets the POSIX timestamp where the JOBS_MAX_AGE window starts."""
+
+    now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
+
+    return now.timestamp() - config.JOBS_MAX_AGE
+
+
+def get_salary_range(salaries, minimum_salary=None, maximum_salary=None):
+    """Finds the positions of the salaries inside a range with a binary search.
+
+    Parameters
+    ----------
+    salaries : numpy.ndarray
+        The salaries, sorted from highest to lowest.
+
+    minimum_salary : int
+        The lowest salary, no limit if it's None.
+
+    maximum_salary : int
+        The highest salary, no limit if it's None.
+
+    Returns
+    -------
+    tuple
+        The (low, high) positions, the salaries inside the range are salaries[low:high].
+
+    """
+
+    # searchsorted requires ascending values, a reversed view doesn't copy the array.
+    ascending = salaries[::-1]
+    low = 0
+    high = len(salaries)
+
+    if minimum_salary is not None:
+        high -= int(np.searchsorted(ascending, minimum_salary, "left"))
+
+    if maximum_salary is not None:
+        low = len(salaries) - int(np.searchsorted(ascending, maximum_salary, "right"))
+
+    return (low, high)
+
+
+class Snapshot:
+    """A snapshot loaded from disk, the arrays are memory mapped.
+
+    Parameters
+    ----------
+    folder : str
+        The folder where the snapshot is saved.
+
+    """
+
+    def __init__(self, folder=SNAPSHOT_FOLDER):
+
+        with open(folder + "manifest.json", "r", encoding="utf-8") as temp_file:
+            manifest = json.load(temp_file)
+
+        self.folder = folder
+        self.version = manifest["version"]
+        self.offset = manifest["offset"]
+        self.states = manifest["states"]
+
+        self.salaries = self.load_array("salary")
+        self.state_codes = self.load_array("state")
+        self.timestamps = self.load_array("timestamp")
+
+        self.strings = {column: self.load_array(column) for column in STRING_COLUMNS}
+        self.offsets = {column: self.load_array(column + "-offsets") for column in STRING_COLUMNS}
+
+    def load_array(self, column):
+        """Memory maps the array of the column."""
+
+        return np.load("{}{}-{}.npy".format(self.folder, self.version, column), mmap_mode="r")
+
+    def get_strings(self, column):
+        """Decodes all the strings of a string table at once.
+
+        Parameters
+        ----------
+        column : str
+            One of STRING_COLUMNS.
+
+        Returns
+        -------
+        list
+            The strings, in the same order as the arrays.
+
+        """
+
+        # The last string is also followed by a separator.
+        return self.strings[column].tobytes().decode("utf-8").split(SEPARATOR)[:-1]
+
+    def get_listing(self, position):
+        """Decodes the strings of a single listing and creates its Listing tuple.
+
+        Parameters
+        ----------
+        position : int
+            The position of the listing.
+
+        Returns
+        -------
+        Listing
+            The listing.
+
+        """
+
+        strings = list()
+
+        # Each string ends right before the separator of the next one.
+        for column in STRING_COLUMNS:
+            start, end = self.offsets[column][position:position + 2].tolist()
+            strings.append(self.strings[column][start:end - 1].tobytes().decode("utf-8"))
+
+        return listings_store.Listing(int(self.salaries[position]), *strings)
+
+
+class Window:
+    """The listings of the window, from highest to lowest salary, as a read only sequence.
+
+    The listings of the snapshot are decoded when they are accessed, the salaries are
+    kept in a NumPy array and the search texts are decoded a column at a time.
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        The snapshot with most of the listings, or None.
+
+    positions : numpy.ndarray
+        The positions of the snapshot listings inside the window, in ascending order.
+
+    listings : list
+        The other Listing tuples, sorted from highest to lowest salary. They go after
+        the snapshot listings with the same salary.
+
+    """
+
+    def __init__(self, snapshot, positions, listings):
+        self.snapshot = snapshot
+        self.listings = listings
+
+        snapshot_salaries = snapshot.salaries[positions] if snapshot is not None else np.empty(0)
+        salaries = np.concatenate([snapshot_salaries, np.fromiter(
+            (listing.salary for listing in listings), dtype=np.int64, count=len(listings))])
+
+        # The order is stable, so the ties keep the snapshot listings first. The sources
+        # are snapshot positions, or -1 - index for the other listings.
+        order = np.argsort(-salaries, kind="stable")
+        sources = np.concatenate([np.asarray(positions, dtype=np.int64),
+                                  -1 - np.arange(len(listings), dtype=np.int64)])
+
+        self.salaries = salaries[order].astype(np.int64)
+        self.sources = sources[order]
+        self.columns = dict()
+
+    @classmethod
+    def from_listings(cls, listings):
+        """Creates a window from Listing tuples already sorted from highest to lowest salary."""
+
+        return cls(None, np.empty(0, dtype=np.int64), listings)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __getitem__(self, listing_id):
+        source = int(self.sources[listing_id])
+
+        if source < 0:
+            return self.listings[-1 - source]
+
+        return self.snapshot.get_listing(source)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self.sources)))
+
+    def select(self, listings_ids):
+        """Creates the window of some of the listings.
+
+        Parameters
+        ----------
+        listings_ids : numpy.ndarray
+            The ids (positions in this window) of the listings, in ascending order.
+
+        Returns
+        -------
+        Window
+            The window with the same snapshot, nothing is decoded.
+
+        """
+
+        window = Window.__new__(Window)
+        window.snapshot = self.snapshot
+        window.listings = self.listings
+        window.salaries = self.salaries[listings_ids]
+        window.sources = self.sources[listings_ids]
+        window.columns = dict()
+
+        return window
+
+    def get_column(self, column):
+        """Gets a string field of all the listings, the snapshot table is decoded at once.
+
+        Parameters
+        ----------
+        column : str
+            One of STRING_COLUMNS.
+
+        Returns
+        -------
+        list
+            The values, in the window order.
+
+        """
+
+        if column not in self.columns:
+
+            strings = self.snapshot.get_strings(column) if self.snapshot is not None else list()
+            values = [getattr(listing, column) for listing in self.listings]
+
+            self.columns[column] = [strings[source] if source >= 0 else values[-1 - source]
+                                    for source in self.sources.tolist()]
+
+        return self.columns[column]
+
+
+def write_snapshot(listings, timestamps, offset, folder=SNAPSHOT_FOLDER):
+    """Saves the listings as a new snapshot version.
+
+    The arrays of the new version are saved first and then the manifest is replaced,
+    so the bots always read a complete snapshot. The previous version is kept for the
+    bots that may still be reading it.
+
+    Parameters
+    ----------
+    listings : list
+        The Listing tuples, sorted from highest to lowest salary.
+
+    timestamps : list
+        The POSIX timestamp of the log entry of each listing.
+
+    offset : int
+        The log offset (as used by log_reader.iter_log) right after the last entry read.
+
+    folder : str
+        The folder where the snapshot is saved.
+
+    """
+
+    os.makedirs(folder, exist_ok=True)
+
+    try:
+        with open(folder + "manifest.json", "r", encoding="utf-8") as temp_file:
+            previous_version = json.load(temp_file)["version"]
+    except (OSError, ValueError, KeyError):
+        previous_version = 0
+
+    version = previous_version + 1
+
+    # The states are saved as codes into a small table.
+    states = sorted({listing.location.split(",")[0].strip() for listing in listings})
+    state_codes = {state: code for code, state in enumerate(states)}
+
+    arrays = {
+        "salary": np.array([listing.salary for listing in listings], dtype=np.int32),
+        "state": np.array([state_codes[listing.location.split(",")[0].strip()]
+                           for listing in listings], dtype=np.int16),
+        "timestamp": np.array(timestamps, dtype=np.float64)
+    }
+
+    # Every string is followed by a separator, the offsets are where each one starts.
+    for column in STRING_COLUMNS:
+        encoded = [(getattr(listing, column) + SEPARATOR).encode("utf-8") for listing in listings]
+
+        arrays[column] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        arrays[column + "-offsets"] = np.concatenate(
+            [[0], np.cumsum([len(x) for x in encoded], dtype=np.int64)]).astype(np.int64)
+
+    for column, array in arrays.items():
+        np.save("{}{}-{}.npy".format(folder, version, column), array)
+
+    with file_utils.replace_file(folder + "manifest.json") as temp_file:
+        json.dump({"version": version, "offset": offset, "count": len(listings),
+                   "states": states}, temp_file, indent=4)
+
+    # Only the new and the previous versions are kept.
+    for file_name in os.listdir(folder):
+
+        file_version = file_name.split("-")[0]
+
+        if file_version.isdigit() and int(file_version) not in (version, previous_version):
+            os.remove(folder + file_name)
+
+
+def read_entries(connection, offset):
+    """Reads the log entries starting at the offset and gets their listings.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the listings store.
+
+    offset : int
+        The log offset where the reading starts.
+
+    Returns
+    -------
+    list
+        The (timestamp, listing) of the entries with all the required values, in log order.
+
+    int
+        The log offset right after the last entry read.
+
+    """
+
+    entries = list(log_reader.iter_log(offset))
+
+    if not entries:
+        return (list(), offset)
+
+    files_list = [file_name for file_name, _, _ in entries]
+    listings = list()
+
+    for (_, file_date, _), values in zip(entries, listings_store.load_listings(connection, files_list)):
+
+        listing = listings_store.get_listing(values)
+
+        if listing is not None:
+            listings.append((datetime.fromisoformat(file_date).timestamp(), listing))
+
+    return (listings, entries[-1][2])
+
+
+def load_window(connection, cutoff_timestamp, folder=SNAPSHOT_FOLDER):
+    """Loads the listings of the window from the snapshot and the log entries added after it.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the listings store.
+
+    cutoff_timestamp : float
+        The POSIX timestamp where the window starts.
+
+    folder : str
+        The folder where the snapshot is saved.
+
+    Returns
+    -------
+    Window
+        The listings sorted from highest to lowest salary, or None if there isn't a snapshot.
+
+    """
+
+    try:
+        snapshot = Snapshot(folder)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # The listings that left the window are discarded without reading them.
+    positions = np.flatnonzero(snapshot.timestamps >= cutoff_timestamp)
+
+    new_entries, _ = read_entries(connection, snapshot.offset)
+    new_listings = [listing for timestamp, listing in new_entries
+                    if timestamp >= cutoff_timestamp]
+
+    # The new listings were logged after the snapshot ones, they go after them on ties.
+    new_listings.sort(reverse=True, key=lambda listing: listing.salary)
+
+    return Window(snapshot, positions, new_listings)
+
+
+def main():
+    """Saves a new snapshot with the listings of the current window."""
+
+    connection = listings_store.connect()
+    cutoff_timestamp = get_cutoff()
+
+    entries, offset = read_entries(
+        connection, log_reader.find_window_offset(cutoff_timestamp))
+
+    entries = [x for x in entries if x[0] >= cutoff_timestamp]
+
+    # The sort is stable, listings with the same salary keep the log order.
+    entries.sort(reverse=True, key=lambda entry: entry[1].salary)
+
+    write_snapshot([listing for _, listing in entries],
+                   [timestamp for timestamp, _ in entries], offset)
+
+    extractor.print_report()
+    print("Snapshot listings:", len(entries))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -2,131 +2,413 @@
 This script extracts all the data required from the .html files and saves it into a .csv file.
 """
 
+import argparse
 import concurrent.futures
 import csv
+import functools
+import glob
+import itertools
+import os
 
-import lxml.html
+import pyarrow
+import pyarrow.parquet
 
+import extractor
+import file_utils
+import listings_store
+import log_reader
+import text_utils
 
-# The next 2 lists must have the same length, since one will replace the other.
-ACCENT_MARKS = ["á", "Á", "é", "É", "í", "Í", "ó", "Ó", "ú", "Ú"]
-FRIENDLY_MARKS = ["a", "A", "e", "E", "i", "I", "o", "O", "u", "U"]
+COLUMNS = ["date", "offer", "salary", "start_hour", "end_hour", "hours_worked", "monday", "tuesday",
+           "wednesday", "thursday", "friday", "saturday", "sunday", "days_worked", "state", "municipality"]
 
+# The rows are written every time this number of log entries is processed,
+# this keeps the memory usage flat no matter how big the log file is.
+BATCH_SIZE = 5000
 
-def load_files():
-    """Reads the log file and extracts all files paths."""
 
-    with open("log.txt", "r", encoding="utf-8") as temp_file:
+def load_files(offset=0, batch_size=BATCH_SIZE):
+    """Reads the log file and extracts the files paths, a batch at a time.
 
-        files_list = list()
+    Parameters
+    ----------
+    offset : int
+        The byte offset where the reading starts, the entries before it were already processed.
+
+    batch_size : int
+        The number of log entries of each batch.
+
+    Yields
+    ------
+    list
+        The (file_name, file_date, end_offset) tuples of the batch, end_offset is the byte
+        offset right after the entry line. The offsets include the archived entries.
+
+    """
+
+    # Only one batch of the history is kept in memory.
+    entries = log_reader.iter_log(offset)
+
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+
+        if not batch:
+            return
+
+        yield batch
+
+
+def load_checkpoint(output_path):
+    """Loads the byte offset of the last log entry saved into the output and the
+    size the output had right after saving it.
+
+    The output is rebuilt from the start when it was saved with another text
+    normalisation, appending to it would mix two spellings of the same offers.
+
+    Parameters
+    ----------
+    output_path : str
+        The .csv file or the .parquet folder where the dataset is saved.
+
+    Returns
+    -------
+    int
+        The byte offset, 0 if there's no checkpoint, the output doesn't exist or
+        it must be rebuilt.
+
+    int
+        The output size (see the writers get_size), None if there's no checkpoint.
+
+    """
+
+    try:
+        if os.path.exists(output_path):
+            with open(output_path + ".checkpoint", "r", encoding="utf-8") as temp_file:
+                values = [int(x) for x in temp_file.read().split()]
+
+            # The checkpoints of previous versions don't have the normalisation version.
+            if len(values) == 3 and values[2] == text_utils.NORMALISATION_VERSION:
+                return (values[0], values[1])
+
+            print("The text normalisation changed, rebuilding:", output_path)
+    except (OSError, ValueError):
+        pass
+
+    return (0, None)
+
+
+def update_checkpoint(output_path, offset, size):
+    """Saves the byte offset of the last log entry saved into the output, the size
+    of the output and the text normalisation version.
+
+    Parameters
+    ----------
+    output_path : str
+        The .csv file or the .parquet folder where the dataset is saved.
+
+    offset : int
+        The byte offset right after the last processed log entry.
+
+    size : int
+        The output size right after saving the rows of that entry.
+
+    """
+
+    with file_utils.replace_file(output_path + ".checkpoint") as temp_file:
+        temp_file.write("{} {} {}".format(offset, size, text_utils.NORMALISATION_VERSION))
+
+
+def parse_file(listing, file_date):
+    """Computes the values of interest from a stored listing.
+
+    Parameters
+    ----------
+    listing : tuple
+        The listing values, in the same order as listings_store.FIELDS.
+
+    file_date : str
+        The date the listing was saved.
+
+    Returns
+    -------
+    tuple
+        The dataset row, or None if the listing is missing any value.
+
+    """
+
+    # Very few times the HTML is corrupted and can't be fixed.
+    if listing is None:
+        return None
+
+    clean_salary, name, location, url, hours, work_days, state, municipality = listing[:8]
 
-        for item in temp_file.read().splitlines():
-            file_name, file_date = item.split(",")
-            files_list.append((file_name, file_date))
+    # The missing values were already counted when the listing was extracted.
+    if None in (clean_salary, name, hours, work_days, state, municipality):
+        return None
 
-        return files_list
+    name = name.split("-")[0].lower().strip()
 
+    clean_words = list()
 
-def parse_file(file_name, file_date):
-    """Parses a .html file and extracts values of interest using lxml.
+    for word in name.split(" "):
+        if word != "a" and word != "de" and word != "en" and not word.isdigit():
+            clean_words.append(word)
+
+    clean_name = text_utils.clean_word(" ".join(clean_words))
+
+    # The hours are like '09:00 a 18:00', the ones in another format are counted.
+    try:
+        hours = hours.split(" ")
+
+        start_hour = int(hours[0].replace(":", ""))
+        end_hour = int(hours[2].replace(":", ""))
+    except (IndexError, ValueError):
+        extractor.failures["hours"] += 1
+        return None
+
+    if start_hour >= end_hour:
+        hours_worked = ((end_hour+2400) - start_hour) / 100
+    else:
+        hours_worked = (end_hour - start_hour) / 100
+
+    monday = 1 if "L" in work_days else 0
+    tuesday = 1 if "Ma" in work_days else 0
+    wednesday = 1 if "Mi" in work_days else 0
+    thursday = 1 if "J" in work_days else 0
+    friday = 1 if "V" in work_days else 0
+    saturday = 1 if "S" in work_days else 0
+    sunday = 1 if "D" in work_days else 0
+
+    days_worked = monday + tuesday + wednesday + \
+        thursday + friday + saturday + sunday
+
+    return (file_date, clean_name, clean_salary, start_hour, end_hour, hours_worked, monday, tuesday,
+            wednesday, thursday, friday, saturday, sunday, days_worked, state, municipality)
+
+
+class CsvWriter:
+    """Writes the dataset rows into a .csv file as they are computed.
 
     Parameters
     ----------
-    file_name : str
-        The name of the file to be parsed.
+    file_path : str
+        The path of the .csv file.
+
+    append : bool
+        Whether to add the rows to the end of an existing file.
+
+    size : int
+        When appending, the file is first truncated to this size in bytes.
 
     """
 
-    with open(file_name, "r", encoding="utf-8") as temp_file:
+    def __init__(self, file_path, append=False, size=None):
+        self.temp_file = open(file_path, "a" if append else "w",
+                              encoding="utf-8", newline="")
+        self.writer = csv.writer(self.temp_file)
+
+        if not append:
+            self.writer.writerow(COLUMNS)
+
+        # The rows written after the last checkpoint are written again.
+        elif size is not None and size < self.get_size():
+            self.temp_file.truncate(size)
 
-        # Very few times the HTML is corrupted and can't be fixed.
-        try:
-            html = lxml.html.fromstring(temp_file.read())
+    def write_rows(self, rows):
+        """Writes a batch of rows and flushes them to disk."""
 
-            salary = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[1]/div/div/span")[0].text
+        self.writer.writerows(rows)
+        self.temp_file.flush()
+        os.fsync(self.temp_file.fileno())
 
-            clean_salary = int(float(salary.replace("$", "").replace(",", "")))
+    def get_size(self):
+        """Gets the size of the file in bytes."""
 
-            name = html.xpath(
-                "/html/body/div[1]/div[8]/div[1]/div/h3/small")[0].text.split("-")[0].lower().strip()
+        self.temp_file.flush()
 
-            clean_words = list()
+        return os.fstat(self.temp_file.fileno()).st_size
 
-            for word in name.split(" "):
-                if word != "a" and word != "de" and word != "en" and not word.isdigit():
-                    clean_words.append(word)
+    def close(self):
+        """Closes the file."""
+
+        self.temp_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParquetWriter:
+    """Writes the dataset rows into a Parquet dataset folder with typed columns.
+    Each batch of rows is saved as its own part file, so it's complete once written.
+
+    Parameters
+    ----------
+    folder_path : str
+        The path of the Parquet dataset folder, it can be read with pandas.read_parquet().
+
+    append : bool
+        Whether to add the new parts next to the existing ones.
+
+    size : int
+        When appending, the parts after this number of parts are removed first.
+
+    """
 
-            clean_name = clean_word(" ".join(clean_words))
+    def __init__(self, folder_path, append=False, size=None):
 
-            hours = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[6]/div/div/span")[0].text.split(" ")
+        self.schema = pyarrow.schema([
+            ("date", pyarrow.timestamp("us")),
+            ("offer", pyarrow.string()),
+            ("salary", pyarrow.int32()),
+            ("start_hour", pyarrow.int16()),
+            ("end_hour", pyarrow.int16()),
+            ("hours_worked", pyarrow.float32())] +
+            [(day, pyarrow.int8()) for day in COLUMNS[6:14]] +
+            [("state", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+             ("municipality", pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))])
 
-            start_hour = int(hours[0].replace(":", ""))
-            end_hour = int(hours[2].replace(":", ""))
+        # A full rebuild replaces all the previous parts of the dataset.
+        self.folder_path = folder_path
+        os.makedirs(folder_path, exist_ok=True)
 
-            if start_hour >= end_hour:
-                hours_worked = ((end_hour+2400) - start_hour) / 100
-            else:
-                hours_worked = (end_hour - start_hour) / 100
+        parts = sorted(glob.glob(os.path.join(folder_path, "part-*.parquet")))
 
-            work_days = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[5]/div/div/span")[0].text
+        # The parts written after the last checkpoint are written again.
+        if not append:
+            size = 0
 
-            monday = 1 if "L" in work_days else 0
-            tuesday = 1 if "Ma" in work_days else 0
-            wednesday = 1 if "Mi" in work_days else 0
-            thursday = 1 if "J" in work_days else 0
-            friday = 1 if "V" in work_days else 0
-            saturday = 1 if "S" in work_days else 0
-            sunday = 1 if "D" in work_days else 0
+        if size is not None:
+            for part in parts[size:]:
+                os.remove(part)
 
-            days_worked = monday + tuesday + wednesday + \
-                thursday + friday + saturday + sunday
+            parts = parts[:size]
 
-            location = html.xpath(
-                "/html/body/div[1]/div[8]/div[4]/div/div[2]/div/div[2]/div/div/span")[0].text
+        self.parts_count = len(parts)
 
-            state, municipality = location.split(",")
+    def write_rows(self, rows):
+        """Writes a batch of rows as a new part file."""
 
-            master_list.append((file_date, clean_name, clean_salary, start_hour, end_hour, hours_worked, monday, tuesday,
-                                wednesday, thursday, friday, saturday, sunday, days_worked, state.strip(), municipality.strip()))
+        if not rows:
+            return
 
-        except:
-            pass
+        columns = [pyarrow.array(column).cast(field.type)
+                   for column, field in zip(zip(*rows), self.schema)]
 
+        pyarrow.parquet.write_table(
+            pyarrow.Table.from_arrays(columns, schema=self.schema),
+            os.path.join(self.folder_path, "part-{:05d}.parquet".format(self.parts_count)))
 
-def clean_word(word):
-    """Cleans the word by replacing non-friendly characters.
+        self.parts_count += 1
+
+    def get_size(self):
+        """Gets the number of part files."""
+
+        return self.parts_count
+
+    def close(self):
+        """Nothing to close, each part file is closed once written."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_writer(output_path, append=False, size=None):
+    """Returns the writer for the specified output, folders ending in .parquet get a ParquetWriter.
+
+    Parameters
+    ----------
+    output_path : str
+        The .csv file or the .parquet folder where the dataset is saved.
+
+    append : bool
+        Whether to add the rows to the existing dataset.
+
+    size : int
+        The output size saved with the checkpoint, what was written after it is discarded.
+
+    """
+
+    if output_path.endswith(".parquet"):
+        return ParquetWriter(output_path, append, size)
+
+    return CsvWriter(output_path, append, size)
+
+
+def extract_listings(connection, files_list, executor, chunk_size=100):
+    """Gets the stored values of every file, the new files are parsed by a pool of processes.
 
     Parameters
     ----------
-    word : str
-        The word to be cleaned.
+    connection : sqlite3.Connection
+        The connection to the listings store.
+
+    files_list : list
+        The (file_name, file_date, end_offset) tuples from the log file.
+
+    executor : concurrent.futures.ProcessPoolExecutor
+        The pool of processes that parses the new files.
+
+    chunk_size : int
+        The number of files each process parses before sending back its results.
 
     Returns
     -------
-    str
-        The cleaned word.
+    list
+        The dataset rows, in the same order as the log file.
 
     """
 
-    for index, char in enumerate(ACCENT_MARKS):
-        word = word.replace(char, FRIENDLY_MARKS[index])
+    # lxml parsing is CPU bound, processes avoid the GIL. Each worker returns its
+    # results in batches of chunk_size listings and only this process writes them.
+    listings = listings_store.load_listings(
+        connection, [x[0] for x in files_list], functools.partial(executor.map, chunksize=chunk_size))
 
-    return word
+    rows = list()
 
+    for listing, (file_name, file_date, end_offset) in zip(listings, files_list):
+        row = parse_file(listing, file_date)
 
-if __name__ == "__main__":
+        if row is not None:
+            rows.append(row)
+
+    return rows
 
-    # We use multithreading to accelerate the reading of all files.
-    master_list = list()
-    master_list.append(["date", "offer", "salary", "start_hour", "end_hour", "hours_worked", "monday", "tuesday",
-                        "wednesday", "thursday", "friday", "saturday", "sunday", "days_worked", "state", "municipality"])
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for file_name, file_date in load_files():
-            executor.submit(parse_file, file_name, file_date)
+if __name__ == "__main__":
 
-    writer = csv.writer(open("data.csv", "w", encoding="utf-8", newline=""))
-    writer.writerows(master_list)
+    parser = argparse.ArgumentParser(
+        description="Extracts the dataset from the job listings files.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes used to parse the files")
+    parser.add_argument("--chunk-size", type=int, default=100,
+                        help="number of files sent to a process at a time")
+    parser.add_argument("--output", default="data.csv",
+                        help="a .csv file or a .parquet folder for typed columns")
+    parser.add_argument("--full", action="store_true",
+                        help="rebuild the dataset from the whole log instead of only the new entries")
+    args = parser.parse_args()
+
+    # The log is append only, we only process the entries added since the last run.
+    offset, size = (0, None) if args.full else load_checkpoint(args.output)
+    connection = listings_store.connect()
+
+    # The rows are written in batches while the log is processed, if the process
+    # dies partway through the rows of the completed batches are already saved
+    # and the checkpoint points right after them. The rows of a batch written
+    # without its checkpoint are discarded by the next run.
+    with open_writer(args.output, append=offset > 0, size=size) as writer, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+
+        for batch in load_files(offset):
+            writer.write_rows(extract_listings(
+                connection, batch, executor, args.chunk_size))
+            update_checkpoint(args.output, batch[-1][2], writer.get_size())
+
+    # The missing values and layout fingerprints of the newly parsed files.
+    extractor.print_report()
@@ -1,21 +1,124 @@
 """
 This script contains several functions that creates plots or get statistical information from the dataset.
 The reader will require to manually call the functions with the main dataframe as the only argument.
+
+The dataset is loaded with load_dataset(), it sets the type of every column and keeps a Parquet
+copy of data.csv next to it, which is only rebuilt when data.csv changes.
 """
 
 import csv
+import os
 
 import geopandas
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
 import pandas as pd
+import pyarrow
+import pyarrow.parquet
 import seaborn as sns
 
+import file_utils
+import text_utils
+
 sns.set()
 
-ACCENT_MARKS = ["á", "Á", "é", "É", "í", "Í", "ó", "Ó", "ú", "Ú"]
-FRIENDLY_MARKS = ["a", "A", "e", "E", "i", "I", "o", "O", "u", "U"]
+DATASET_FILE = "data.csv"
+
+# The day flags are 0 or 1 and the hours are like 900 or 1800, the small integer types
+# and the categories take a fraction of the memory of the default int64 and object columns.
+DAYS_COLUMNS = ["monday", "tuesday", "wednesday",
+                "thursday", "friday", "saturday", "sunday"]
+
+# The offers stay as strings, value_counts() orders the ties of a category column by
+# category instead of by first appearance and that changes the order of medians.csv.
+DTYPES = {"salary": "int32", "start_hour": "int16", "end_hour": "int16",
+          "hours_worked": "float32", "days_worked": "int8", "state": "category",
+          "municipality": "category", **{day: "int8" for day in DAYS_COLUMNS}}
+
+# step2.py saves the dates with str(datetime), the microseconds are omitted when they are 0.
+DATE_FORMAT = "ISO8601"
+
+# The size and modification time of data.csv are saved in the Parquet copy metadata.
+SOURCE_METADATA_KEY = b"step3_source"
+
+# Increased when DTYPES changes, the Parquet copies of older versions are rebuilt.
+CACHE_VERSION = 2
+
+
+def read_csv(file_path):
+    """Reads the dataset .csv file with the column types and a fixed date format.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the .csv file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The dataset.
+
+    """
+
+    df = pd.read_csv(file_path, dtype=DTYPES)
+    df["date"] = pd.to_datetime(df["date"], format=DATE_FORMAT)
+
+    return df
+
+
+def load_dataset(file_path=DATASET_FILE, use_cache=True):
+    """Loads the dataset with typed columns.
+
+    The .csv file is read once and saved as Parquet next to it (data.csv.parquet), the
+    next loads read the Parquet copy until the .csv file changes. The Parquet dataset
+    folder created by step2.py (--output data.parquet) can also be loaded.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the .csv file or the Parquet dataset folder.
+
+    use_cache : bool
+        Whether to read and save the Parquet copy of the .csv file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The dataset.
+
+    """
+
+    # The step2.py Parquet dataset is already typed, the strings are converted to categories.
+    if os.path.isdir(file_path):
+        return pd.read_parquet(file_path).astype(DTYPES)
+
+    if not use_cache:
+        return read_csv(file_path)
+
+    cache_path = file_path + ".parquet"
+    stats = os.stat(file_path)
+    source = "{}:{}:{}".format(CACHE_VERSION, stats.st_size, stats.st_mtime_ns).encode("utf-8")
+
+    try:
+        table = pyarrow.parquet.read_table(cache_path)
+
+        if (table.schema.metadata or dict()).get(SOURCE_METADATA_KEY) == source:
+            return table.to_pandas()
+    except (OSError, pyarrow.ArrowInvalid):
+        pass
+
+    df = read_csv(file_path)
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, SOURCE_METADATA_KEY: source})
+
+    # The copy is replaced at once, a reader never finds it half written.
+    with file_utils.replace_file(cache_path, "wb") as temp_file:
+        pyarrow.parquet.write_table(table, temp_file)
+
+    return df
 
 
 def get_basic_stats(df):
@@ -227,27 +330,6 @@ def create_donut():
     plt.savefig("donut1.png")
 
 
-def clean_word(word):
-    """Cleans the word by replacing non-friendly characters.
-
-    Parameters
-    ----------
-    word : str
-        The word to be cleaned.
-
-    Returns
-    -------
-    str
-        The cleaned word.
-
-    """
-
-    for index, char in enumerate(ACCENT_MARKS):
-        word = word.replace(char, FRIENDLY_MARKS[index])
-
-    return word
-
-
 def generate_maps(df):
     """Generates 2 maps using geopandas, one for median salaries and one for offers count.
 
@@ -261,10 +343,10 @@ def generate_maps(df):
     mexico_df = geopandas.read_file("./mexicostates")
 
     # We will get the median salary for each state and add it into its new column.
-    for item in df.groupby("state")["salary"].median().items():
+    for item in df.groupby("state", observed=True)["salary"].median().items():
 
         # We remove accent marks and rename Ciudad de Mexico to its former name.
-        clean_name = clean_word(item[0])
+        clean_name = text_utils.clean_word(item[0])
 
         if clean_name == "Ciudad de Mexico":
             clean_name = "Distrito Federal"
@@ -274,7 +356,7 @@ def generate_maps(df):
 
     # Now we will get the amount of offers for each state.
     for item in df["state"].value_counts().items():
-        clean_name = clean_word(item[0])
+        clean_name = text_utils.clean_word(item[0])
 
         if clean_name == "Ciudad de Mexico":
             clean_name = "Distrito Federal"
@@ -293,30 +375,52 @@ def generate_maps(df):
     plt.savefig("map1.png")
 
 
-def generate_median_by_profession(df):
+def generate_median_by_profession(df, quantile=0.5, min_count=1):
     """Generates a csv file with the most popular professions.
 
+    The counts and salaries of all offers are computed in a single grouped aggregation.
+
     Parameters
     ----------
     df : pandas.DataFrame
         The DataFrame to be plotted.
 
+    quantile : float
+        The salary quantile of each offer, 0.5 is the median.
+
+    min_count : int
+        The minimum number of listings an offer requires to be included.
+
     """
 
+    counts = df["offer"].value_counts()
+    counts = counts[counts >= min_count]
+
+    salaries = df.groupby("offer", sort=False, observed=True)["salary"]
+
+    if quantile == 0.5:
+        salaries = salaries.median()
+        column_name = "median_salary"
+    else:
+        salaries = salaries.quantile(quantile)
+        column_name = "quantile_{}_salary".format(quantile)
+
+    # We keep the same order as value_counts(), from the most to the least popular.
+    salaries = salaries.reindex(counts.index)
+
     with open("medians.csv", "w", encoding="utf-8", newline="") as temp_file:
         temp_list = list()
-        temp_list.append(["offer", "median_salary", "count"])
+        temp_list.append(["offer", column_name, "count"])
 
-        for item, count in df["offer"].value_counts()[:].items():
-            median_salary = df[df["offer"] == item]["salary"].median()
-            temp_list.append([item, int(median_salary), count])
+        for item, salary, count in zip(counts.index, salaries.values, counts.values):
+            temp_list.append([item, int(salary), count])
 
         csv.writer(temp_file).writerows(temp_list)
 
 
 if __name__ == "__main__":
 
-    main_df = pd.read_csv("data.csv", parse_dates=["date"])
+    main_df = load_dataset()
     total = len(main_df)
 
     generate_median_by_profession(main_df)
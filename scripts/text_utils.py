@@ -0,0 +1,65 @@
+"""
+This module contains the text normalisation shared by all the scripts.
+"""
+
+import functools
+
+# The next 2 strings must have the same length, since one will replace the other.
+ACCENT_MARKS = "áÁéÉíÍóÓúÚñÑüÜàÀèÈìÌòÒùÙäÄëËïÏöÖâÂêÊîÎôÔûÛ"
+FRIENDLY_MARKS = "aAeEiIoOuUnNuUaAeEiIoOuUaAeEiIoOaAeEiIoOuU"
+
+# It changes every time the marks above change, the datasets saved with another version
+# have different spellings and are rebuilt.
+NORMALISATION_VERSION = 2
+
+# All characters are replaced in a single pass with str.translate. A list indexed by
+# code point is faster to look up than the dict from str.maketrans, the characters
+# outside the list are left as they are.
+TRANSLATION_TABLE = [chr(x) for x in range(max(map(ord, ACCENT_MARKS)) + 1)]
+
+for accent_mark, friendly_mark in zip(ACCENT_MARKS, FRIENDLY_MARKS):
+    TRANSLATION_TABLE[ord(accent_mark)] = friendly_mark
+
+
+def clean_word(word):
+    """Cleans the word by replacing non-friendly characters.
+
+    Parameters
+    ----------
+    word : str
+        The word to be cleaned.
+
+    Returns
+    -------
+    str
+        The cleaned word.
+
+    """
+
+    # Most words don't have any accent marks.
+    if word.isascii():
+        return word
+
+    return word.translate(TRANSLATION_TABLE)
+
+
+@functools.lru_cache(maxsize=4096)
+def clean_location(location):
+    """Cleans a location ('State, Municipality') by replacing non-friendly characters.
+
+    There are only a few thousand locations, so the results are cached. The offers and
+    names are almost all different, they use clean_word directly.
+
+    Parameters
+    ----------
+    location : str
+        The location to be cleaned.
+
+    Returns
+    -------
+    str
+        The cleaned location.
+
+    """
+
+    return clean_word(location)
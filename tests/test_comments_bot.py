@@ -0,0 +1,250 @@
+"""
+Tests the comments_bot daemon mode with fake Reddit and listings store clients, nothing
+is sent to Reddit.
+
+python3 -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import prawcore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import comments_bot  # noqa: E402
+import config  # noqa: E402
+import listings_store  # noqa: E402
+import log_reader  # noqa: E402
+
+
+class FakeComment:
+    """A PRAW comment with only the values the bot reads."""
+
+    def __init__(self, comment_id, link_id):
+
+        self.id = comment_id
+        self.link_id = link_id
+
+
+class FakeSubmission:
+    """A PRAW submission that only knows its subreddit."""
+
+    def __init__(self, subreddit_name):
+
+        self.subreddit = mock.Mock(display_name=subreddit_name)
+
+
+class FakeReddit:
+    """A PRAW client whose comment stream yields the specified items and then ends."""
+
+    def __init__(self, stream_items):
+
+        self.stream_items = stream_items
+        self.subreddit_names = list()
+
+    def submission(self, id):
+
+        return FakeSubmission("mexico")
+
+    def subreddit(self, name):
+
+        self.subreddit_names.append(name)
+        subreddit = mock.Mock()
+        subreddit.stream.comments.return_value = iter(self.stream_items)
+
+        return subreddit
+
+
+class FakeScheduler:
+    """A ReplyScheduler that only records the scheduled comments."""
+
+    def __init__(self, reddit=None, comments_log=None):
+
+        self.comments = list()
+        self.metrics_printed = False
+
+    def schedule(self, comment):
+
+        self.comments.append(comment)
+
+    def print_metrics(self):
+
+        self.metrics_printed = True
+
+
+class FakeWindow:
+    """A ListingsWindow that reports the specified changes."""
+
+    def __init__(self, changes):
+
+        self.changes = list(changes)
+
+    def refresh(self):
+
+        return self.changes.pop(0)
+
+
+class ListingsWindowTest(unittest.TestCase):
+
+    def setUp(self):
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        # The log files have relative paths.
+        current_dir = os.getcwd()
+        os.chdir(temp_dir.name)
+        self.addCleanup(os.chdir, current_dir)
+
+        # The stored values of each file, the files that were requested are recorded.
+        self.values = dict()
+        self.requested = list()
+
+        def load_listings(connection, files_list):
+            self.requested.append(list(files_list))
+            return [self.values.get(x) for x in files_list]
+
+        store_patch = mock.patch.object(listings_store, "load_listings", load_listings)
+        store_patch.start()
+        self.addCleanup(store_patch.stop)
+
+        self.now = datetime.now() - timedelta(hours=config.DELTA_HOURS)
+
+    def add_entry(self, file_name, age, salary):
+
+        if salary is not None:
+            self.values[file_name] = (salary, "Chofer - Acme", "Jalisco, Zapopan",
+                                      "https://example.com/" + file_name, None, None,
+                                      None, None, None)
+
+        with open(log_reader.LOG_FILE, "a", encoding="utf-8") as temp_file:
+            temp_file.write("{},{}\n".format(file_name, self.now - timedelta(seconds=age)))
+
+    def test_offset(self):
+
+        self.add_entry("./states/14/1.html", config.JOBS_MAX_AGE + 3600, 9000)
+        self.add_entry("./states/14/2.html", 60, 10000)
+
+        window = comments_bot.ListingsWindow(None)
+        version = comments_bot.snapshot_version
+
+        # The first refresh starts at the window start, the old entry isn't read.
+        self.assertTrue(window.refresh())
+        self.assertEqual(self.requested, [["./states/14/2.html"]])
+        self.assertEqual(window.offset, os.path.getsize(log_reader.LOG_FILE))
+        self.assertEqual([x.salary for x in comments_bot.master_list], [10000])
+        self.assertEqual(comments_bot.snapshot_version, version + 1)
+
+        # Only the new entries are read, the listings stay sorted by salary.
+        self.add_entry("./states/14/3.html", 30, 12000)
+        self.add_entry("./states/14/4.html", 30, 8000)
+
+        self.assertTrue(window.refresh())
+        self.assertEqual(self.requested[1:], [["./states/14/3.html", "./states/14/4.html"]])
+        self.assertEqual([x.salary for x in comments_bot.master_list], [12000, 10000, 8000])
+        self.assertEqual(comments_bot.snapshot_version, version + 2)
+
+        # Without new entries nothing is read and the version is kept.
+        self.assertFalse(window.refresh())
+        self.assertEqual(len(self.requested), 2)
+        self.assertEqual(comments_bot.snapshot_version, version + 2)
+
+    def test_expiry(self):
+
+        # The listing with missing values expires like the others.
+        self.add_entry("./states/14/1.html", 3000, 9000)
+        self.add_entry("./states/14/2.html", 2000, None)
+        self.add_entry("./states/14/3.html", 60, 10000)
+
+        window = comments_bot.ListingsWindow(None)
+        window.refresh()
+        version = comments_bot.snapshot_version
+
+        self.assertEqual(len(window.entries), 3)
+        self.assertEqual([x.salary for x in comments_bot.master_list], [10000, 9000])
+
+        # The window gets shorter, the two oldest entries leave it.
+        with mock.patch.object(config, "JOBS_MAX_AGE", 1000):
+            self.assertTrue(window.refresh())
+
+        self.assertEqual(len(window.entries), 1)
+        self.assertEqual([x.salary for x in comments_bot.master_list], [10000])
+        self.assertEqual(comments_bot.snapshot_version, version + 1)
+        self.assertIsNone(comments_bot.query_index)
+
+
+class StreamCommentsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        for patch in [mock.patch.object(config, "SUBMISSION_IDS", ["abc123", "def456"]),
+                      mock.patch.object(comments_bot, "master_list", [], create=True),
+                      mock.patch.object(comments_bot.time, "sleep"),
+                      mock.patch.object(comments_bot.extractor, "print_report")]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_stream(self):
+
+        comments = [FakeComment("c1", "t3_abc123"), FakeComment("c2", "t3_zzz999"),
+                    FakeComment("c3", "t3_def456")]
+        reddit = FakeReddit([comments[0], None, comments[1], None, comments[2]])
+        scheduler = FakeScheduler()
+        window = FakeWindow([True, False])
+
+        comments_bot.stream_comments(reddit, scheduler, window)
+
+        # Only the comments of the monitored threads are scheduled.
+        self.assertEqual(scheduler.comments, [comments[0], comments[2]])
+        self.assertEqual(reddit.subreddit_names, ["mexico"])
+
+        # Each pause refreshed the listings and waited, the report is only
+        # printed when the listings changed.
+        self.assertEqual(window.changes, [])
+        self.assertEqual(comments_bot.time.sleep.call_args_list,
+                         [mock.call(comments_bot.POLL_INTERVAL)] * 2)
+        comments_bot.extractor.print_report.assert_called_once_with(reset=True)
+
+
+class RunDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.scheduler = FakeScheduler()
+
+        for patch in [mock.patch.object(comments_bot, "ListingsWindow"),
+                      mock.patch.object(comments_bot, "CommentsLog"),
+                      mock.patch.object(comments_bot, "ReplyScheduler", return_value=self.scheduler),
+                      mock.patch.object(comments_bot.time, "sleep"),
+                      mock.patch.object(comments_bot.extractor, "print_report")]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_error_recovery(self):
+
+        # The Reddit errors are retried, any other error stops the daemon.
+        load_comments = mock.Mock(side_effect=[prawcore.exceptions.PrawcoreException("down"), None])
+        stream_comments = mock.Mock(side_effect=RuntimeError("stop"))
+
+        with mock.patch.object(comments_bot, "load_comments", load_comments), \
+                mock.patch.object(comments_bot, "stream_comments", stream_comments):
+            with self.assertRaises(RuntimeError):
+                comments_bot.run_daemon(mock.Mock(), None)
+
+        self.assertEqual(load_comments.call_count, 2)
+        stream_comments.assert_called_once()
+        comments_bot.time.sleep.assert_called_once_with(comments_bot.RETRY_INTERVAL)
+        comments_bot.ListingsWindow.return_value.refresh.assert_called_once()
+
+        # The metrics are printed even when the daemon stops.
+        self.assertTrue(self.scheduler.metrics_printed)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
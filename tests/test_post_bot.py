@@ -0,0 +1,127 @@
+"""
+Tests the post_bot edits with a fake Reddit client, nothing is sent to Reddit.
+
+python3 -m pytest tests
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import post_bot  # noqa: E402
+
+
+class FakeSubmission:
+    """A PRAW submission that records its edits, or fails them."""
+
+    def __init__(self, reddit, post_id):
+
+        self.reddit = reddit
+        self.post_id = post_id
+
+    def edit(self, body):
+
+        if self.reddit.fail_edits:
+            raise RuntimeError("Reddit is down.")
+
+        self.reddit.edits.append((self.post_id, body))
+
+
+class FakeReddit:
+    """A PRAW client that only creates fake submissions."""
+
+    def __init__(self, fail_edits=False):
+
+        self.fail_edits = fail_edits
+        self.edits = list()
+
+    def submission(self, post_id):
+
+        return FakeSubmission(self, post_id)
+
+
+class UpdatePostTest(unittest.TestCase):
+
+    def setUp(self):
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        hashes_patch = mock.patch.object(
+            post_bot, "POST_HASHES_FILE", os.path.join(temp_dir.name, "post_hashes.json"))
+        hashes_patch.start()
+        self.addCleanup(hashes_patch.stop)
+
+        self.table = "Oferta | Empresa\n--|--\nChofer | Acme\n"
+        self.table_hash = hashlib.sha1(self.table.encode("utf-8")).hexdigest()
+
+    def test_unchanged_table(self):
+
+        post_bot.save_post_hashes({"abc123": self.table_hash})
+
+        with mock.patch.object(post_bot, "create_reddit") as create_reddit:
+            reddit = post_bot.update_post(self.table + "footer", self.table,
+                                          post_ids=["abc123"])
+
+        create_reddit.assert_not_called()
+        self.assertIsNone(reddit)
+
+    def test_changed_table(self):
+
+        post_bot.save_post_hashes({"abc123": "old hash"})
+        fake_reddit = FakeReddit()
+
+        with mock.patch.object(post_bot, "create_reddit", return_value=fake_reddit):
+            reddit = post_bot.update_post(self.table + "footer", self.table,
+                                          post_ids=["abc123"])
+
+        self.assertIs(reddit, fake_reddit)
+        self.assertEqual(fake_reddit.edits, [("abc123", self.table + "footer")])
+        self.assertEqual(post_bot.load_post_hashes(), {"abc123": self.table_hash})
+
+    def test_failed_edit(self):
+
+        post_bot.save_post_hashes({"abc123": "old hash"})
+
+        with mock.patch.object(post_bot, "create_reddit",
+                               return_value=FakeReddit(fail_edits=True)):
+            with self.assertRaises(RuntimeError):
+                post_bot.update_post(self.table + "footer", self.table,
+                                     post_ids=["abc123"])
+
+        self.assertEqual(post_bot.load_post_hashes(), {"abc123": "old hash"})
+
+
+class CheckDigestsTest(unittest.TestCase):
+
+    def test_valid_digests(self):
+
+        # The states are compared without case or accent marks, like the listings.
+        post_bot.check_digests([{"post_ids": ["a"]},
+                                {"post_ids": ["b"], "state": "Nuevo León"},
+                                {"post_ids": ["c"], "state": "ciudad de mexico ", "keyword": "chofer"}])
+
+    def test_unknown_state(self):
+
+        with self.assertRaises(ValueError):
+            post_bot.check_digests([{"post_ids": ["a"], "state": "Jaslico"}])
+
+    def test_keyword_type(self):
+
+        with self.assertRaises(ValueError):
+            post_bot.check_digests([{"post_ids": ["a"], "keyword": None}])
+
+    def test_shared_post(self):
+
+        with self.assertRaises(ValueError):
+            post_bot.check_digests([{"post_ids": ["a"]}, {"post_ids": ["a"], "state": "Jalisco"}])
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,204 @@
+"""
+Tests the scraper against a local HTTP server, nothing is sent to the real site.
+
+python3 -m pytest tests
+"""
+
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import scraper  # noqa: E402
+
+STATE_URL = scraper.STATES_URLS[0]
+
+STATE_PAGE = """<html><body><table>
+<tr><td><a href="/detalleoferta?id=101">Chofer</a></td></tr>
+<tr><td><a href="/detalleoferta?id=102">Cajero</a></td></tr>
+</table></body></html>"""
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the state page and its listings, the behaviour is set on the server."""
+
+    def do_GET(self):
+
+        server = self.server
+        server.requests.append((self.path, self.headers.get("If-None-Match")))
+
+        if self.path == "/" + STATE_URL:
+
+            if server.etag and self.headers.get("If-None-Match") == server.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            self.send_body(200, STATE_PAGE, server.etag)
+
+        elif self.path.startswith("/detalleoferta"):
+
+            listing_id = self.path.split("=")[-1]
+
+            if listing_id in server.failing_ids:
+                self.send_body(500, "Error")
+            elif server.flaky_ids.get(listing_id):
+                server.flaky_ids[listing_id] -= 1
+                self.send_body(503, "Busy")
+            else:
+                self.send_body(200, "<html>Listing {}</html>".format(listing_id))
+
+        else:
+            self.send_body(404, "Not found")
+
+    def send_body(self, status, text, etag=None):
+
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+
+        if etag:
+            self.send_header("ETag", etag)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        pass
+
+
+class DownloadStateTest(unittest.TestCase):
+
+    def setUp(self):
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        # The scraper uses relative paths for the states folders, the log and the cache.
+        current_dir = os.getcwd()
+        os.chdir(temp_dir.name)
+        self.addCleanup(os.chdir, current_dir)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.requests = list()
+        self.server.etag = '"v1"'
+        self.server.failing_ids = set()
+        self.server.flaky_ids = dict()
+
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        # The retries are not spaced out, the tests would otherwise wait seconds.
+        backoff_patch = mock.patch.object(scraper, "BACKOFF_FACTOR", 0)
+        backoff_patch.start()
+        self.addCleanup(backoff_patch.stop)
+
+        scraper.create_folders()
+        self.init_scraper()
+
+    def init_scraper(self):
+
+        scraper.init(rate=1000, base_url="http://127.0.0.1:{}".format(self.server.server_port))
+
+    def listing_requests(self):
+
+        return [path for path, _ in self.server.requests if path.startswith("/detalleoferta")]
+
+    def test_not_modified(self):
+
+        scraper.download_state(STATE_URL)
+
+        self.assertEqual(len(self.listing_requests()), 2)
+        self.assertTrue(os.path.exists("./states/1/101.html"))
+        self.assertTrue(os.path.exists("./states/1/102.html"))
+
+        # The next run sends the ETag and the server answers without the page.
+        self.server.requests.clear()
+        self.init_scraper()
+        scraper.download_state(STATE_URL)
+
+        self.assertEqual(self.server.requests, [("/" + STATE_URL, '"v1"')])
+
+    def test_unchanged_hash(self):
+
+        # Without an ETag the page is sent again, its hash shows that it didn't change.
+        self.server.etag = None
+        scraper.download_state(STATE_URL)
+        os.remove("./states/1/101.html")
+
+        self.server.requests.clear()
+        self.init_scraper()
+        scraper.download_state(STATE_URL)
+
+        self.assertEqual(self.server.requests, [("/" + STATE_URL, None)])
+        self.assertFalse(os.path.exists("./states/1/101.html"))
+
+    def test_failed_listing(self):
+
+        self.server.failing_ids = {"102"}
+
+        with self.assertRaises(scraper.requests.HTTPError):
+            scraper.download_state(STATE_URL)
+
+        # The listing saved before the failure is kept, the page is not marked as processed.
+        self.assertTrue(os.path.exists("./states/1/101.html"))
+        self.assertNotIn(STATE_URL, scraper.load_state_cache())
+
+        # The next run requests the whole page again and only downloads the missing listing.
+        self.server.failing_ids = set()
+        self.server.requests.clear()
+        self.init_scraper()
+        scraper.download_state(STATE_URL)
+
+        self.assertEqual(self.server.requests[0], ("/" + STATE_URL, None))
+        self.assertEqual(self.listing_requests(), ["/detalleoferta?id=102"])
+
+        with open(scraper.STATE_CACHE_FILE, "r", encoding="utf-8") as temp_file:
+            self.assertEqual(json.load(temp_file)[STATE_URL]["etag"], '"v1"')
+
+    def test_retries(self):
+
+        # The listing is answered with a 503 twice before it is sent.
+        self.server.flaky_ids = {"101": 2}
+
+        with mock.patch.object(scraper.rate_limiter, "wait",
+                               wraps=scraper.rate_limiter.wait) as wait:
+            scraper.download_state(STATE_URL)
+
+        self.assertEqual(self.listing_requests(), ["/detalleoferta?id=101"] * 3 +
+                         ["/detalleoferta?id=102"])
+
+        # Every attempt went through the rate limiter.
+        self.assertEqual(wait.call_count, len(self.server.requests))
+
+        with open("./states/1/101.html", "r", encoding="utf-8") as temp_file:
+            self.assertEqual(temp_file.read(), "<html>Listing 101</html>")
+
+    def test_retries_exhausted(self):
+
+        self.server.failing_ids = {"101"}
+
+        with mock.patch.object(scraper.rate_limiter, "wait",
+                               wraps=scraper.rate_limiter.wait) as wait:
+            with self.assertRaises(scraper.requests.HTTPError):
+                scraper.download_state(STATE_URL)
+
+        self.assertEqual(self.listing_requests(),
+                         ["/detalleoferta?id=101"] * (scraper.MAX_RETRIES + 1))
+        self.assertEqual(wait.call_count, len(self.server.requests))
+        self.assertFalse(os.path.exists("./states/1/101.html"))
+
+
+if __name__ == "__main__":
+
+    unittest.main()